@@ -0,0 +1,355 @@
+import bisect
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+
+import numpy as np
+import pandas as pd
+
+MINUTE_NS = 60 * 10**9
+DEFAULT_VARIANT = "all"
+
+
+def _id_keys(column):
+    """
+    String join keys for an id column. Every tailed chunk infers its own
+    dtypes, so a blank id turns a chunk's integer ids into floats; key those
+    as integers again so "1.0" still matches "1".
+    """
+    if column.dtype.kind == "f" and (column.dropna() % 1 == 0).all():
+        column = column.astype("Int64")
+    return column.astype(str).to_numpy()
+
+
+class MinuteBucket:
+    """Aggregates for recommendations made within one minute, for one variant."""
+
+    __slots__ = ("num_recs", "num_rated", "rating_sum", "rating_sum_sq",
+                 "rating_hist", "watched", "watch_sum")
+
+    def __init__(self):
+        self.num_recs = 0
+        self.num_rated = 0
+        self.rating_sum = 0.0
+        self.rating_sum_sq = 0.0
+        self.rating_hist = {}
+        self.watched = 0
+        self.watch_sum = 0.0
+
+
+class _PendingRec:
+    __slots__ = ("time_ns", "bucket", "max_minute")
+
+    def __init__(self, time_ns, bucket):
+        self.time_ns = time_ns
+        self.bucket = bucket
+        self.max_minute = None
+
+
+class FeedbackAttributor:
+    """
+    Streaming join of recommendations with the rate and watch events that follow them.
+
+    Recommendation rows are exploded into (user, movie) entries that stay
+    pending for attribution_window; later rate/watch events for the same pair
+    are credited to the minute bucket the recommendation was made in. State is
+    bounded by max_pending (oldest entries are dropped first), and metrics for
+    any window are obtained by summing buckets rather than re-joining logs.
+
+    On start and after a log rotation the cached logs are replayed with an
+    as-of join instead of file by file, so each feedback row is credited as
+    it would have been had the three logs been streamed in time order.
+    """
+
+    def __init__(self, rec_tail, rate_tail, watch_tail,
+                 attribution_window=pd.Timedelta(days=7), max_pending=1_000_000):
+        self._tails = (rec_tail, rate_tail, watch_tail)
+        self._window_ns = int(pd.Timedelta(attribution_window).value)
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._clear()
+
+        rec_tail.add_listener(lambda rows: self._on_rows(rows, self._add_recommendations))
+        rate_tail.add_listener(lambda rows: self._on_rows(rows, self._add_ratings))
+        watch_tail.add_listener(lambda rows: self._on_rows(rows, self._add_watches))
+        self._rebuild()
+
+    def _clear(self):
+        self._pending = OrderedDict()
+        self._buckets = {}
+        self._minutes = []
+        self._variants = set()
+        self._needs_rebuild = False
+
+    def _on_rows(self, rows, handler):
+        with self._lock:
+            if rows is None:
+                # A log file was truncated or rotated: derived state is stale
+                self._needs_rebuild = True
+            elif not self._needs_rebuild:
+                handler(rows)
+
+    def _rebuild(self):
+        # Listeners run with their tail's lock held and then take ours, so take
+        # the tail locks first here too; that also keeps rows from arriving mid-replay
+        rec_tail, rate_tail, watch_tail = self._tails
+        with ExitStack() as stack:
+            for tail in self._tails:
+                stack.enter_context(tail.lock)
+            stack.enter_context(self._lock)
+            self._clear()
+            self._replay(rec_tail.frame(), rate_tail.frame(), watch_tail.frame())
+
+    def sync(self):
+        """Replay all cached rows if a log file was reset since the last call."""
+        with self._lock:
+            needs_rebuild = self._needs_rebuild
+        if needs_rebuild:
+            self._rebuild()
+        return self
+
+    @staticmethod
+    def _times_ns(rows):
+        return rows["time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def _bucket(self, minute, variant):
+        by_variant = self._buckets.get(minute)
+        if by_variant is None:
+            by_variant = self._buckets[minute] = {}
+            bisect.insort(self._minutes, minute)
+        bucket = by_variant.get(variant)
+        if bucket is None:
+            bucket = by_variant[variant] = MinuteBucket()
+            self._variants.add(variant)
+        return bucket
+
+    def _evict(self, now_ns):
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if len(self._pending) <= self._max_pending and now_ns - entry.time_ns <= self._window_ns:
+                break
+            del self._pending[key]
+
+    def _explode(self, rows):
+        """
+        Count rows' recommendations into their minute buckets and return one
+        entry per recommended (user, movie): a DataFrame of user, movie, time
+        and group (an index into the returned bucket list). None if rows has none.
+        """
+        if rows.empty or "result" not in rows:
+            return None
+        rows = rows[rows["time"].notna().to_numpy()]
+        if rows.empty:
+            return None
+        times = self._times_ns(rows)
+        users = _id_keys(rows["user_id"])
+        results = rows["result"].astype(str)
+        counts = (results.str.count(";") + 1).to_numpy()
+        movies = ";".join(results).split(";")
+        variants = rows["server"].astype(str).to_numpy() if "server" in rows else DEFAULT_VARIANT
+
+        # Count the recommendations per (minute, variant) and fetch each bucket once
+        groups = pd.DataFrame({"minute": times - times % MINUTE_NS, "variant": variants, "count": counts})
+        grouped = groups.groupby(["minute", "variant"], sort=False)
+        buckets = []
+        for (minute, variant), count in grouped["count"].sum().items():
+            bucket = self._bucket(int(minute), variant)
+            bucket.num_recs += int(count)
+            buckets.append(bucket)
+
+        entries = pd.DataFrame({
+            "user": np.repeat(users, counts),
+            "movie": movies,
+            "time": np.repeat(times, counts),
+            "group": np.repeat(grouped.ngroup().to_numpy(), counts),
+        })
+        return entries, buckets
+
+    def _add_recommendations(self, rows):
+        exploded = self._explode(rows)
+        if exploded is None:
+            return
+        entries, buckets = exploded
+
+        # Only the last recommendation of a pair in this batch stays pending, and
+        # of those only the newest max_pending would survive eviction
+        entries = entries[~entries.duplicated(["user", "movie"], keep="last").to_numpy()].tail(self._max_pending)
+        self._make_pending(entries, buckets)
+        self._evict(int(entries["time"].max()))
+
+    def _make_pending(self, entries, buckets, max_minutes=None):
+        pending = self._pending
+        if max_minutes is None:
+            max_minutes = [None] * len(entries)
+        for user, movie, time_ns, group, max_minute in zip(entries["user"].tolist(), entries["movie"].tolist(),
+                                                           entries["time"].tolist(), entries["group"].tolist(),
+                                                           max_minutes):
+            key = (user, movie)
+            # A repeated recommendation takes over attribution for the pair
+            pending.pop(key, None)
+            entry = pending[key] = _PendingRec(time_ns, buckets[group])
+            entry.max_minute = max_minute
+
+    def _attribute(self, entries, rows, column):
+        """
+        Match each feedback row with a value in column to the latest
+        recommendation of its (user, movie) made at most attribution_window
+        before it. Returns the matched rows' entry numbers and values.
+        """
+        if rows.empty:
+            return np.empty(0, dtype=np.int64), pd.Series(dtype=float)
+        rows = rows[(rows["time"].notna() & rows[column].notna()).to_numpy()]
+        feedback = pd.DataFrame({
+            "user": _id_keys(rows["user_id"]),
+            "movie": _id_keys(rows["movie_id"]),
+            "time": self._times_ns(rows),
+            "value": rows[column].to_numpy(),
+        }).sort_values("time", kind="stable")
+        matched = pd.merge_asof(feedback, entries[["user", "movie", "time", "entry"]], on="time",
+                                by=["user", "movie"], direction="backward", tolerance=self._window_ns)
+        matched = matched[matched["entry"].notna().to_numpy()]
+        return matched["entry"].to_numpy(dtype=np.int64), matched["value"]
+
+    def _replay(self, rec_rows, rate_rows, watch_rows):
+        """
+        Rebuild the buckets and pending entries from complete logs. Every
+        feedback row is credited to the recommendation that was pending for
+        it at its own time, so the result does not depend on the order the
+        three logs are replayed in; only the pairs still pending at the end
+        are kept, as if max_pending had evicted the older ones.
+        """
+        exploded = self._explode(rec_rows)
+        if exploded is None:
+            return
+        entries, buckets = exploded
+        # A later entry for the same pair and time takes over, as in streaming
+        entries = entries[~entries.duplicated(["user", "movie", "time"], keep="last").to_numpy()]
+        entries = entries.reset_index(drop=True)
+        entries["entry"] = np.arange(len(entries))
+        groups = entries["group"].to_numpy()
+
+        matched, ratings = self._attribute(entries, rate_rows, "rating")
+        counts = pd.DataFrame({"group": groups[matched], "rating": ratings.to_numpy()}).groupby(["group", "rating"]).size()
+        for group, rating, count in zip(counts.index.get_level_values(0).tolist(),
+                                        counts.index.get_level_values(1).tolist(), counts.tolist()):
+            bucket = buckets[group]
+            bucket.num_rated += count
+            bucket.rating_sum += rating * count
+            bucket.rating_sum_sq += rating * rating * count
+            bucket.rating_hist[rating] = bucket.rating_hist.get(rating, 0) + count
+
+        # Only the longest watch of each recommendation counts
+        matched, minutes = self._attribute(entries, watch_rows, "minute")
+        max_minutes = minutes.groupby(matched).max()
+        watched = pd.DataFrame({"group": groups[max_minutes.index.to_numpy()], "minute": max_minutes.to_numpy()})
+        watched = watched.groupby("group")["minute"].agg(["size", "sum"])
+        for group, size, total in zip(watched.index.tolist(), watched["size"].tolist(), watched["sum"].tolist()):
+            bucket = buckets[group]
+            bucket.watched += size
+            bucket.watch_sum += total
+
+        latest = entries[~entries.duplicated(["user", "movie"], keep="last").to_numpy()]
+        latest = latest[(latest["time"].max() - latest["time"] <= self._window_ns).to_numpy()].tail(self._max_pending)
+        watch = max_minutes.reindex(latest["entry"].to_numpy())
+        self._make_pending(latest, buckets, [None if pd.isna(m) else m for m in watch.tolist()])
+
+    def _lookup(self, user, movie, time_ns):
+        entry = self._pending.get((user, movie))
+        if entry is None or time_ns < entry.time_ns or time_ns - entry.time_ns > self._window_ns:
+            return None
+        return entry
+
+    def _feedback(self, rows, column):
+        """(user, movie, time, value) of the rows with a time and a value in column."""
+        rows = rows[(rows["time"].notna() & rows[column].notna()).to_numpy()]
+        return zip(_id_keys(rows["user_id"]).tolist(), _id_keys(rows["movie_id"]).tolist(),
+                   self._times_ns(rows).tolist(), rows[column].tolist())
+
+    def _add_ratings(self, rows):
+        if rows.empty:
+            return
+        for user, movie, time_ns, rating in self._feedback(rows, "rating"):
+            entry = self._lookup(user, movie, time_ns)
+            if entry is None:
+                continue
+            bucket = entry.bucket
+            bucket.num_rated += 1
+            bucket.rating_sum += rating
+            bucket.rating_sum_sq += rating * rating
+            bucket.rating_hist[rating] = bucket.rating_hist.get(rating, 0) + 1
+
+    def _add_watches(self, rows):
+        if rows.empty:
+            return
+        for user, movie, time_ns, minute in self._feedback(rows, "minute"):
+            entry = self._lookup(user, movie, time_ns)
+            if entry is None:
+                continue
+            bucket = entry.bucket
+            if entry.max_minute is None:
+                bucket.watched += 1
+                bucket.watch_sum += minute
+                entry.max_minute = minute
+            elif minute > entry.max_minute:
+                bucket.watch_sum += minute - entry.max_minute
+                entry.max_minute = minute
+
+    def variants(self):
+        with self._lock:
+            return sorted(self._variants)
+
+    def summarize(self, start, end, variant=None):
+        """
+        Sum the buckets whose minute falls in [start, end] (optionally for one variant).
+        Returns the same metric keys as the dashboard's compute_metrics.
+        """
+        start_ns = pd.Timestamp(start).value
+        end_ns = pd.Timestamp(end).value
+        total = MinuteBucket()
+        with self._lock:
+            lo = bisect.bisect_left(self._minutes, start_ns - start_ns % MINUTE_NS)
+            hi = bisect.bisect_right(self._minutes, end_ns)
+            for minute in self._minutes[lo:hi]:
+                for name, bucket in self._buckets[minute].items():
+                    if variant is not None and name != variant:
+                        continue
+                    total.num_recs += bucket.num_recs
+                    total.num_rated += bucket.num_rated
+                    total.rating_sum += bucket.rating_sum
+                    total.rating_sum_sq += bucket.rating_sum_sq
+                    for rating, count in bucket.rating_hist.items():
+                        total.rating_hist[rating] = total.rating_hist.get(rating, 0) + count
+                    total.watched += bucket.watched
+                    total.watch_sum += bucket.watch_sum
+
+        n = total.num_rated
+        mean_rating = total.rating_sum / n if n else None
+        if n > 1:
+            rating_variance = max(total.rating_sum_sq - total.rating_sum ** 2 / n, 0.0) / (n - 1)
+        else:
+            rating_variance = np.nan if n == 1 else None
+
+        return {
+            "num_recs": total.num_recs,
+            "num_rated_recs": n,
+            "mean_rating": mean_rating,
+            "rating_variance": rating_variance,
+            "rating_distribution": dict(sorted(total.rating_hist.items())),
+            "watched_recs": total.watched,
+            "avg_watch_time": total.watch_sum / total.watched if total.watched else 0.0,
+            "watch_coverage": total.watched / total.num_recs if total.num_recs else 0.0,
+        }
+
+
+_attributors = {}
+_attributors_lock = threading.Lock()
+
+
+def get_attributor(rec_tail, rate_tail, watch_tail):
+    """Return the process-wide FeedbackAttributor for these three log tails."""
+    key = (rec_tail.path, rate_tail.path, watch_tail.path)
+    with _attributors_lock:
+        attributor = _attributors.get(key)
+        if attributor is None:
+            attributor = _attributors[key] = FeedbackAttributor(rec_tail, rate_tail, watch_tail)
+    return attributor.sync()
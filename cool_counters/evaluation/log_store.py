@@ -0,0 +1,163 @@
+import csv
+import io
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# int64 value pandas uses for NaT; sorts before every valid timestamp
+NAT_NS = np.iinfo(np.int64).min
+
+
+class LogTail:
+    """
+    Process-level cache of one CSV log file.
+
+    The file is parsed once and afterwards only the bytes appended since the
+    last refresh are read and parsed, so a refresh costs time proportional to
+    the new rows. Parsed chunks are kept as they are and only concatenated
+    (and sorted by time, if they arrived out of order) when frame() asks for
+    every row.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        # Re-entrant so consumers can hold it across frame() while rebuilding
+        self.lock = threading.RLock()
+        self._listeners = []
+        self._reset()
+
+    def add_listener(self, listener):
+        """
+        Register listener(rows) to be called with every batch of newly parsed
+        rows, in file order. It is called with None when the cache starts
+        over, so consumers holding derived state know to rebuild it.
+        """
+        with self.lock:
+            self._listeners.append(listener)
+
+    def _reset(self):
+        self._offset = 0
+        self._inode = None
+        self._columns = None
+        self._chunks = []
+        self._rows = 0
+        self._max_ns = NAT_NS
+        self._in_order = True
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def refresh(self):
+        """
+        Pick up rows appended since the last call.
+        Starts over if the file was truncated or replaced (e.g. rotated).
+        A trailing line without a newline is left for the next refresh, since
+        the writer may still be in the middle of it.
+        """
+        with self.lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                if self._inode is not None:
+                    self._reset()
+                    self._notify(None)
+                return self
+
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                had_rows = self._inode is not None
+                self._reset()
+                self._inode = stat.st_ino
+                if had_rows:
+                    self._notify(None)
+
+            if stat.st_size > self._offset:
+                new_rows = self._read_new_rows()
+                if new_rows is not None and not new_rows.empty:
+                    self._append(new_rows)
+                    self._notify(new_rows)
+        return self
+
+    def _notify(self, rows):
+        for listener in self._listeners:
+            listener(rows)
+
+    def _read_new_rows(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+
+        # Only consume complete lines
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return None
+        chunk = chunk[:end]
+        self._offset += end
+
+        if self._columns is None:
+            header, _, chunk = chunk.partition(b"\n")
+            self._columns = next(csv.reader([header.decode("utf-8").strip()]))
+        if not chunk.strip():
+            return None
+
+        rows = pd.read_csv(io.BytesIO(chunk), header=None, names=self._columns)
+        rows["time"] = pd.to_datetime(rows["time"], errors="coerce")
+        return rows
+
+    def _append(self, rows):
+        rows_ns = self._times_ns(rows)
+        # Logs are appended roughly in time order; frame() only re-sorts when they are not
+        self._in_order = self._in_order and rows_ns[0] >= self._max_ns and bool(np.all(rows_ns[1:] >= rows_ns[:-1]))
+        self._max_ns = max(self._max_ns, int(rows_ns.max()))
+        self._rows += len(rows)
+        self._chunks.append(rows)
+        # Merge chunks of similar size, so a live log keeps O(log n) chunks
+        # and each row is copied O(log n) times in total
+        while len(self._chunks) > 1 and len(self._chunks[-2]) <= 2 * len(self._chunks[-1]):
+            last = self._chunks.pop()
+            self._chunks[-1] = pd.concat([self._chunks[-1], last], ignore_index=True)
+
+    @staticmethod
+    def _times_ns(rows):
+        return rows["time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def empty(self):
+        with self.lock:
+            return self._rows == 0
+
+    def frame(self):
+        """Return a copy of every cached row, sorted by time."""
+        with self.lock:
+            if not self._chunks:
+                return pd.DataFrame()
+            if len(self._chunks) > 1 or not self._in_order:
+                frame = pd.concat(self._chunks, ignore_index=True)
+                if not self._in_order:
+                    order = np.argsort(self._times_ns(frame), kind="stable")
+                    frame = frame.iloc[order].reset_index(drop=True)
+                # Keep the merged frame, so the next call only merges newer chunks
+                self._chunks = [frame]
+                self._in_order = True
+            return self._chunks[0].copy()
+
+    def max_time(self):
+        """Latest valid timestamp in the file, or NaT."""
+        with self.lock:
+            if self._rows == 0 or self._max_ns == NAT_NS:
+                return pd.NaT
+            return pd.Timestamp(self._max_ns)
+
+
+_log_tails = {}
+_log_tails_lock = threading.Lock()
+
+
+def get_log_tail(path):
+    """Return the process-wide LogTail for path, refreshed with any new rows."""
+    path = str(path)
+    with _log_tails_lock:
+        tail = _log_tails.get(path)
+        if tail is None:
+            tail = _log_tails[path] = LogTail(path)
+    return tail.refresh()
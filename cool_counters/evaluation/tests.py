@@ -1,8 +1,7 @@
 from django.test import TestCase
-from cool_counters.evaluation import views
+from cool_counters.evaluation import views, log_store, attribution
 import pandas as pd
 from datetime import timedelta
-import numpy as np
 import os
 import tempfile
 
@@ -34,20 +33,6 @@ class TestEvaluationApp(TestCase):
         # Remove temporary directory
         self.test_dir.cleanup()
 
-    def test_load_logs(self):
-        rec_df, rate_df, watch_df = views.load_logs()
-        
-        # Check if pandas DataFrame objects are returned
-        self.assertIsInstance(rec_df, pd.DataFrame)
-        self.assertIsInstance(rate_df, pd.DataFrame)
-        self.assertIsInstance(watch_df, pd.DataFrame)
-        
-        # Verify content of recommendation log
-        self.assertEqual(len(rec_df), 1)
-        self.assertEqual(rec_df.iloc[0]['user_id'], 1)
-        self.assertEqual(rec_df.iloc[0]['movie_id'], 'movie1')
-        self.assertEqual(rec_df.iloc[0]['result'], 'movie1;movie2')
-
     def test_parse_timeframe_param(self):
         timeframe_str = "LastHour"
         timeframe = views.parse_timeframe_param(timeframe_str)
@@ -94,38 +79,6 @@ class TestEvaluationApp(TestCase):
             # Restore original
             views.compute_metrics = original_compute_metrics
 
-    def test_calculate_rating_metrics(self):
-        rec_expanded = pd.DataFrame({
-            "user_id": [1, 2],
-            "movie_id": ["movie1", "movie2"]
-        })
-        rate_df = pd.DataFrame({
-            "user_id": [1, 2],
-            "movie_id": ["movie1", "movie1"],
-            "rating": [4, 3]
-        })
-        num_rated_recs, mean_rating, rating_variance, rating_distribution = views.calculate_rating_metrics(rec_expanded, rate_df)
-        self.assertEqual(num_rated_recs, 1)
-        self.assertEqual(mean_rating, 4.0)  # For recommended movies
-        # Check variance of single value
-        self.assertTrue(np.isnan(rating_variance))
-        self.assertEqual(rating_distribution, {4: 1})
-
-    def test_calculate_watch_metrics(self):
-        rec_expanded = pd.DataFrame({
-            "user_id": [1, 2],
-            "movie_id": ["movie1", "movie2"]
-        })
-        watch_df = pd.DataFrame({
-            "user_id": [1, 2],
-            "movie_id": ["movie1", "movie1"],
-            "minute": [90, 5]
-        })
-        watched_recs, avg_watch_time, watch_coverage = views.calculate_watch_metrics(rec_expanded, watch_df)
-        self.assertEqual(watched_recs, 1)
-        self.assertEqual(avg_watch_time, 90)
-        self.assertEqual(watch_coverage, 0.5)
-    
     def test_home_view(self):
         response = self.client.get('/evaluation/')
         self.assertEqual(response.status_code, 200)
@@ -140,3 +93,180 @@ class TestEvaluationApp(TestCase):
         response = self.client.get('/evaluation/health/')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content.decode(), 'OK')
+
+    def test_log_tail_reads_only_appended_rows(self):
+        rec_path = os.path.join(self.data_dir, "recommendationlog_2025-03.csv")
+        tail = log_store.LogTail(rec_path).refresh()
+        self.assertEqual(len(tail.frame()), 1)
+
+        with open(rec_path, 'a') as f:
+            f.write("2,movie2,2025-03-01 12:30:00,movie3\n")
+            # Partially written line is held back until it is complete
+            f.write("3,movie3,2025-03-01 12:4")
+        tail.refresh()
+        self.assertEqual(list(tail.frame()["user_id"]), [1, 2])
+
+        with open(rec_path, 'a') as f:
+            f.write("5:00,movie1\n")
+        tail.refresh()
+        self.assertEqual(list(tail.frame()["user_id"]), [1, 2, 3])
+        self.assertEqual(tail.max_time(), pd.Timestamp("2025-03-01 12:45:00"))
+
+    def test_log_tail_sorts_out_of_order_rows(self):
+        rec_path = os.path.join(self.data_dir, "recommendationlog_2025-03.csv")
+        with open(rec_path, 'a') as f:
+            f.write("2,movie2,2025-03-01 14:00:00,movie3\n")
+            f.write("3,movie3,2025-03-01 11:00:00,movie1\n")
+        tail = log_store.LogTail(rec_path).refresh()
+
+        self.assertEqual(list(tail.frame()["user_id"]), [3, 1, 2])
+        self.assertEqual(tail.max_time(), pd.Timestamp("2025-03-01 14:00:00"))
+
+    def test_log_tail_resets_on_truncate(self):
+        rec_path = os.path.join(self.data_dir, "recommendationlog_2025-03.csv")
+        tail = log_store.LogTail(rec_path).refresh()
+        with open(rec_path, 'w') as f:
+            f.write("user_id,movie_id,time,result\n")
+        tail.refresh()
+        self.assertTrue(tail.empty())
+
+    def test_compute_metrics_from_log_files(self):
+        rec_path, rate_path, watch_path = views.get_paths()
+        with open(rec_path, 'w') as f:
+            f.write("time,user_id,result\n")
+            f.write("2025-03-01 12:00:00,1,movie1;movie2\n")
+        with open(rate_path, 'w') as f:
+            f.write("movie_id,rating,time,user_id\n")
+            f.write("movie1,4,2025-03-01 12:10:00,1\n")
+        with open(watch_path, 'w') as f:
+            f.write("minute,movie_id,time,user_id\n")
+            f.write("90,movie2,2025-03-01 12:20:00,1\n")
+
+        results = views.compute_metrics(timeframe="LastHour")
+        self.assertIsNone(results["error"])
+        self.assertEqual(results["num_recs"], 2)
+        self.assertEqual(results["num_rated_recs"], 1)
+        self.assertEqual(results["mean_rating"], 4.0)
+        self.assertEqual(results["watched_recs"], 1)
+        self.assertEqual(results["watch_coverage"], 0.5)
+
+        # Rows appended after the first request show up on the next one
+        with open(rate_path, 'a') as f:
+            f.write("movie2,2,2025-03-01 12:30:00,1\n")
+        results = views.compute_metrics(timeframe="LastHour")
+        self.assertEqual(results["num_rated_recs"], 2)
+        self.assertEqual(results["mean_rating"], 3.0)
+
+    def test_parse_custom_timeframes(self):
+        self.assertEqual(views.parse_timeframe_param("Last30Minutes"), timedelta(minutes=30))
+        self.assertEqual(views.parse_timeframe_param("Last3Days"), timedelta(days=3))
+        self.assertEqual(views.parse_timeframe_param("6h"), timedelta(hours=6))
+        self.assertEqual(views.parse_timeframe_param("Last0Hours"), timedelta(hours=1))
+        # Huge N is clamped instead of overflowing the timedelta / timestamp arithmetic
+        self.assertEqual(views.parse_timeframe_param("Last300000Days"), views.MAX_TIMEFRAME)
+        self.assertEqual(views.parse_timeframe_param("Last9999999999Days"), views.MAX_TIMEFRAME)
+        for timeframe in ("Last300000Days", "Last9999999999Days"):
+            response = self.client.get('/evaluation/evaluate/', {'timeframe': timeframe})
+            self.assertEqual(response.status_code, 200)
+
+    def test_attributor_buckets_feedback_per_variant(self):
+        rec_path, rate_path, watch_path = views.get_paths()
+        with open(rec_path, 'w') as f:
+            f.write("time,user_id,server,status,result,response_time\n")
+            f.write("2025-03-01 12:00:10,1,svc-a,200,m1;m2,100\n")
+            f.write("2025-03-01 12:05:00,2,svc-b,200,m1;m3,120\n")
+        with open(rate_path, 'w') as f:
+            f.write("movie_id,rating,time,user_id\n")
+            # Rated before it was recommended: not attributed
+            f.write("m3,1,2025-03-01 11:00:00,2\n")
+            f.write("m1,5,2025-03-01 12:01:00,1\n")
+            f.write("m1,3,2025-03-01 12:06:00,2\n")
+        with open(watch_path, 'w') as f:
+            f.write("minute,movie_id,time,user_id\n")
+            f.write("10,m2,2025-03-01 12:02:00,1\n")
+            f.write("40,m2,2025-03-01 12:03:00,1\n")
+
+        tails = views.get_log_tails()
+        attributor = attribution.FeedbackAttributor(*tails)
+        self.assertEqual(attributor.variants(), ["svc-a", "svc-b"])
+
+        start, end = pd.Timestamp("2025-03-01 12:00:00"), pd.Timestamp("2025-03-01 13:00:00")
+        both = attributor.summarize(start, end)
+        self.assertEqual(both["num_recs"], 4)
+        self.assertEqual(both["num_rated_recs"], 2)
+        self.assertEqual(both["mean_rating"], 4.0)
+        self.assertEqual(both["rating_variance"], 2.0)
+        self.assertEqual(both["rating_distribution"], {3: 1, 5: 1})
+        # Only the max watch minute per recommendation counts
+        self.assertEqual(both["watched_recs"], 1)
+        self.assertEqual(both["avg_watch_time"], 40)
+
+        svc_b = attributor.summarize(start, end, variant="svc-b")
+        self.assertEqual(svc_b["num_recs"], 2)
+        self.assertEqual(svc_b["rating_distribution"], {3: 1})
+        self.assertEqual(svc_b["watched_recs"], 0)
+
+        # Window covering only the first minute
+        first = attributor.summarize(start, pd.Timestamp("2025-03-01 12:00:59"))
+        self.assertEqual(first["num_recs"], 2)
+
+        # Newly appended feedback is picked up through the tails
+        with open(rate_path, 'a') as f:
+            f.write("m2,4,2025-03-01 12:10:00,1\n")
+        views.get_log_tails()
+        self.assertEqual(attributor.summarize(start, end)["num_rated_recs"], 3)
+
+    def test_attributor_matches_ids_from_chunks_parsed_as_float(self):
+        rec_path, rate_path, watch_path = views.get_paths()
+        with open(rec_path, 'w') as f:
+            f.write("time,user_id,result\n")
+            f.write("2025-03-01 12:00:00,1,movie1;movie2\n")
+        with open(rate_path, 'w') as f:
+            f.write("movie_id,rating,time,user_id\n")
+        with open(watch_path, 'w') as f:
+            f.write("minute,movie_id,time,user_id\n")
+        views.get_log_tails()
+
+        # The blank user_id makes this chunk's user ids parse as floats
+        with open(rate_path, 'a') as f:
+            f.write("movie1,5,2025-03-01 12:05:00,\n")
+            f.write("movie1,4,2025-03-01 12:10:00,1\n")
+        results = views.compute_metrics(timeframe="LastHour")
+        self.assertEqual(results["num_rated_recs"], 1)
+        self.assertEqual(results["mean_rating"], 4.0)
+
+    def test_rebuilt_attribution_matches_streamed(self):
+        rec_path, rate_path, watch_path = views.get_paths()
+        with open(rec_path, 'w') as f:
+            f.write("time,user_id,server,result\n")
+        with open(rate_path, 'w') as f:
+            f.write("movie_id,rating,time,user_id\n")
+        with open(watch_path, 'w') as f:
+            f.write("minute,movie_id,time,user_id\n")
+        streamed = attribution.FeedbackAttributor(*views.get_log_tails())
+
+        events = [
+            (rec_path, "2025-03-01 12:00:00,1,svc-a,m1;m2\n"),
+            (rate_path, "m1,4,2025-03-01 12:10:00,1\n"),
+            (watch_path, "30,m2,2025-03-01 12:20:00,1\n"),
+            # Rated before the pair is recommended again: still credited to the first one
+            (rate_path, "m2,2,2025-03-02 12:00:00,1\n"),
+            (rec_path, "2025-03-03 09:00:00,1,svc-b,m2\n"),
+            (watch_path, "50,m2,2025-03-03 09:30:00,1\n"),
+            # Much later than the first recommendations' attribution window
+            (rec_path, "2025-03-20 08:00:00,2,svc-b,m3\n"),
+        ]
+        for path, line in events:
+            with open(path, 'a') as f:
+                f.write(line)
+            views.get_log_tails()
+
+        rebuilt = attribution.FeedbackAttributor(*views.get_log_tails())
+        start, end = pd.Timestamp("2025-03-01"), pd.Timestamp("2025-03-21")
+        self.assertEqual(rebuilt.summarize(start, end), streamed.summarize(start, end))
+        for variant in ("svc-a", "svc-b"):
+            self.assertEqual(rebuilt.summarize(start, end, variant), streamed.summarize(start, end, variant))
+
+        summary = rebuilt.summarize(start, end)
+        self.assertEqual((summary["num_recs"], summary["num_rated_recs"], summary["watched_recs"]), (4, 2, 2))
+
@@ -3,9 +3,13 @@ from django.http import HttpResponse, JsonResponse
 import pandas as pd
 import numpy as np
 import os
+import re
 from datetime import datetime, timedelta
 import pathlib
 
+from .attribution import get_attributor
+from .log_store import get_log_tail
+
 # Define paths relative to the project root
 def get_paths():
     # Get the absolute path to the project root
@@ -26,108 +30,53 @@ def get_paths():
     
     return recommendation_log_path, rating_log_path, datalog_path
 
-def load_logs():
+def get_log_tails():
     """
-    Load recommendation, rating, and watch logs into DataFrames.
-    Returns (rec_df, rate_df, watch_df).
+    Return the cached (rec, rate, watch) LogTails, refreshed with any rows
+    appended since the last request.
     """
-    recommendation_log_path, rating_log_path, datalog_path = get_paths()
-    rec_df, rate_df, watch_df = None, None, None
-
-    if os.path.exists(recommendation_log_path):
-        rec_df = pd.read_csv(recommendation_log_path)
-        rec_df["time"] = pd.to_datetime(rec_df["time"], errors="coerce")
-
-    if os.path.exists(rating_log_path):
-        rate_df = pd.read_csv(rating_log_path)
-        rate_df["time"] = pd.to_datetime(rate_df["time"], errors="coerce")
-
-    if os.path.exists(datalog_path):
-        watch_df = pd.read_csv(datalog_path)
-        watch_df["time"] = pd.to_datetime(watch_df["time"], errors="coerce")
+    return tuple(get_log_tail(path) for path in get_paths())
 
-    return rec_df, rate_df, watch_df
+TIMEFRAME_PATTERN = re.compile(r"^(?:last)?(\d*)(minutes?|mins?|m|hours?|h|days?|d)$")
+TIMEFRAME_UNITS = {"m": "minutes", "h": "hours", "d": "days"}
+# Longer timeframes are clamped, so huge N cannot overflow the window arithmetic
+MAX_TIMEFRAME = timedelta(days=3650)
 
 def parse_timeframe_param(timeframe_str):
     """
-    Convert timeframe strings like 'LastHour' or 'Last7Days' to a timedelta.
+    Convert timeframe strings like 'LastHour', 'Last7Days', 'Last30Minutes'
+    or '6h' to a timedelta. Unrecognised values fall back to one hour,
+    and timeframes longer than MAX_TIMEFRAME are clamped to it.
     """
     tf = timeframe_str.strip().lower()
-    if tf == "lasthour":
-        return timedelta(hours=1)
-    elif tf == "last24hours":
-        return timedelta(hours=24)
-    elif tf == "last7days":
-        return timedelta(days=7)
-    else:
+    match = TIMEFRAME_PATTERN.match(tf)
+    if not match:
         return timedelta(hours=1)  # default
 
-def filter_dataframes_by_time(rec_df, rate_df, watch_df, cutoff_time, log_now):
-    """
-    Filters the dataframes to include only rows within the specified time range.
-    """
-    rec_df = rec_df[(rec_df["time"] >= cutoff_time) & (rec_df["time"] <= log_now)]
-    if not rate_df.empty:
-        rate_df = rate_df[(rate_df["time"] >= cutoff_time) & (rate_df["time"] <= log_now)]
-    if not watch_df.empty:
-        watch_df = watch_df[(watch_df["time"] >= cutoff_time) & (watch_df["time"] <= log_now)]
-    return rec_df, rate_df, watch_df
-
-def calculate_rating_metrics(rec_expanded, rate_df):
-    """
-    Calculates rating-related metrics.
-    """
-    merged_ratings = pd.merge(
-        rec_expanded,
-        rate_df,
-        how="inner",
-        on=["user_id", "movie_id"]
-    ) if not rate_df.empty else pd.DataFrame()
-
-    num_rated_recs = len(merged_ratings)
-    mean_rating = merged_ratings["rating"].mean() if not merged_ratings.empty else None
-    rating_variance = merged_ratings["rating"].var(ddof=1) if not merged_ratings.empty else None
-    rating_distribution = merged_ratings["rating"].value_counts().sort_index().to_dict() if not merged_ratings.empty else {}
-
-    return num_rated_recs, mean_rating, rating_variance, rating_distribution
+    amount = int(match.group(1)) if match.group(1) else 1
+    if amount <= 0:
+        return timedelta(hours=1)
+    unit = timedelta(**{TIMEFRAME_UNITS[match.group(2)[0]]: 1})
+    if amount > MAX_TIMEFRAME // unit:
+        return MAX_TIMEFRAME
+    return amount * unit
 
-def calculate_watch_metrics(rec_expanded, watch_df):
-    """
-    Calculates watch time-related metrics.
-    """
-    if watch_df.empty:
-        return 0, 0.0, 0.0
-
-    watch_agg = watch_df.groupby(["user_id", "movie_id"])["minute"].max().reset_index(name="watch_time")
-    rec_watch_merged = pd.merge(
-        rec_expanded,
-        watch_agg,
-        how="inner",
-        on=["user_id", "movie_id"]
-    )
-    watched_recs = len(rec_watch_merged)
-    avg_watch_time = rec_watch_merged["watch_time"].mean() if watched_recs > 0 else 0.0
-    watch_coverage = watched_recs / len(rec_expanded) if len(rec_expanded) > 0 else 0.0
-
-    return watched_recs, avg_watch_time, watch_coverage
-
-def compute_metrics(timeframe="LastHour"):
+def compute_metrics(timeframe="LastHour", variant=None):
     """
     Extended version that also considers watch time from datalog.
+    Rate/watch events are attributed to the recommendations they follow as
+    the logs are tailed; the window is answered from per-minute buckets,
+    optionally restricted to one model variant (the serving host).
     """
-    rec_df, rate_df, watch_df = load_logs()
+    rec_tail, rate_tail, watch_tail = get_log_tails()
     # Basic validation
-    if rec_df is None or rec_df.empty:
+    if not rec_tail.exists() or rec_tail.empty():
         return {"error": "No recommendation logs found", "num_recs": 0}
-    if rate_df is None or rate_df.empty:
-        rate_df = pd.DataFrame(columns=["movie_id", "rating", "time", "user_id"])
-    if watch_df is None or watch_df.empty:
-        watch_df = pd.DataFrame(columns=["minute", "movie_id", "time", "user_id"])
 
     # 1) Find latest timestamps to anchor 'log_now'
-    max_rec_time  = rec_df["time"].max()
-    max_rate_time = rate_df["time"].max() if not rate_df.empty else pd.NaT
-    max_watch_time= watch_df["time"].max() if not watch_df.empty else pd.NaT
+    max_rec_time  = rec_tail.max_time()
+    max_rate_time = rate_tail.max_time()
+    max_watch_time= watch_tail.max_time()
 
     # If we have no valid timestamps, bail out
     if pd.isna(max_rec_time) and pd.isna(max_rate_time) and pd.isna(max_watch_time):
@@ -137,10 +86,11 @@ def compute_metrics(timeframe="LastHour"):
     delta = parse_timeframe_param(timeframe)
     cutoff_time = log_now - delta
 
-    # 2) Filter all DataFrames to [cutoff_time, log_now]
-    rec_df, rate_df, watch_df = filter_dataframes_by_time(rec_df, rate_df, watch_df, cutoff_time, log_now)
+    # 2) Sum the per-minute attribution buckets for recommendations in [cutoff_time, log_now]
+    attributor = get_attributor(rec_tail, rate_tail, watch_tail)
+    summary = attributor.summarize(cutoff_time, log_now, variant=variant)
 
-    if rec_df.empty:
+    if summary["num_recs"] == 0:
         return {
             "error": "No recommendations found in that timeframe.",
             "num_recs": 0,
@@ -154,16 +104,16 @@ def compute_metrics(timeframe="LastHour"):
             "watch_coverage": 0.0
         }
 
-    # 3) Explode recommended movies
-    rec_df["recommended_movies"] = rec_df["result"].astype(str).apply(lambda x: x.split(';'))
-    rec_expanded = rec_df.explode("recommended_movies").rename(columns={"recommended_movies": "movie_id"})
-    num_recs = len(rec_expanded)
+    num_recs = summary["num_recs"]
+    num_rated_recs = summary["num_rated_recs"]
+    mean_rating = summary["mean_rating"]
+    rating_variance = summary["rating_variance"]
+    rating_distribution = summary["rating_distribution"]
+    watched_recs = summary["watched_recs"]
+    avg_watch_time = summary["avg_watch_time"]
+    watch_coverage = summary["watch_coverage"]
 
-    # 4) Calculate metrics
-    num_rated_recs, mean_rating, rating_variance, rating_distribution = calculate_rating_metrics(rec_expanded, rate_df)
-    watched_recs, avg_watch_time, watch_coverage = calculate_watch_metrics(rec_expanded, watch_df)
-
-    # 5) Build final results dictionary
+    # 3) Build final results dictionary
     results = {
         "error": None,
         "num_recs": num_recs,
@@ -193,16 +143,26 @@ def home(request):
     return render(request, 'evaluation/index.html')
 
 def evaluate(request):
-    """Evaluate metrics based on selected timeframe"""
+    """Evaluate metrics based on selected timeframe and model variant"""
     timeframe = request.GET.get("timeframe", "LastHour")
-    results = compute_metrics(timeframe)
+    variant = request.GET.get("variant") or None
+    results = compute_metrics(timeframe, variant=variant)
     
     # Add the timeframe to the results for the template
     context = results.copy()
     context['timeframe'] = timeframe
+    context['variant'] = variant or ""
+    context['variants'] = get_variants()
     
     return render(request, 'evaluation/index.html', context)
 
+def get_variants():
+    """Model variants (serving hosts) seen in the recommendation log."""
+    rec_tail, rate_tail, watch_tail = get_log_tails()
+    if not rec_tail.exists():
+        return []
+    return get_attributor(rec_tail, rate_tail, watch_tail).variants()
+
 def health(request):
     """Simple health check endpoint"""
     return HttpResponse('OK')
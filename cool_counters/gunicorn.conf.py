@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the inference service.
+
+With GUNICORN_PRELOAD=1 the application is imported once in the master
+process (preload_app), so the PredictionService built by cool_counters.wsgi
+-- NCF embeddings, id mappings and the interaction DataFrame -- lives in
+memory that forked workers share copy-on-write instead of each worker
+loading a private copy.
+
+Preloading is off by default: the integrated weight updater is started when
+the app is imported, and with preload_app its thread would only run in the
+master, so workers would never pick up reloaded weights.
+"""
+import gc
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8082")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+
+# Load the model in the master before forking workers (disables weight hot reload)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+
+def when_ready(server):
+    # Move everything allocated while loading the app into the permanent
+    # generation, so the cyclic GC in each worker never touches (and thereby
+    # un-shares) the pages holding the model and data objects
+    if preload_app:
+        gc.freeze()
+        server.log.info(f"Frozen {gc.get_freeze_count()} objects before forking workers")
@@ -16,5 +16,9 @@ echo "Starting the Django application with Gunicorn"
 cd /app
 export PYTHONPATH=/app:$PYTHONPATH
 
-# The integrated weight updater will run as part of the Django application
-gunicorn --bind 0.0.0.0:8082 --workers 2 cool_counters.wsgi:application
+# The integrated weight updater will run as part of the Django application.
+# Each worker loads the app itself so its updater thread runs there;
+# GUNICORN_PRELOAD=1 shares the model pages instead but turns off hot reload
+# (see gunicorn.conf.py). Scale with GUNICORN_WORKERS.
+export GUNICORN_WORKERS=${GUNICORN_WORKERS:-2}
+gunicorn --config /app/gunicorn.conf.py cool_counters.wsgi:application
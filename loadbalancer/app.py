@@ -1,11 +1,24 @@
 import os
+import re
+import math
 import time
 import json
 import random
+import hashlib
 import logging
+import threading
+import http.cookiejar
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 import requests
-from flask import Flask, request, jsonify, Response
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as UpstreamBodyError
+from flask import Flask, request, jsonify, Response, stream_with_context
 from requests.exceptions import RequestException
+from request_metrics import RequestMetrics
+from health import HealthTracker
+from response_cache import (
+    MAX_SHARED_BODY, ResponseCache, SharedResponse, SingleFlight, UnsharedResponse, share_key
+)
 
 # Configure logging
 logging.basicConfig(
@@ -20,6 +33,33 @@ app = Flask(__name__)
 SERVICE_A_URL = os.environ.get('SERVICE_A_URL', 'http://128.2.205.118:8083')
 SERVICE_B_URL = os.environ.get('SERVICE_B_URL', 'http://128.2.205.118:8084')
 
+# Keep-alive connections kept open to each variant's service
+POOL_SIZE = int(os.environ.get('POOL_SIZE', 100))
+UPSTREAM_TIMEOUT = 30
+STATUS_TIMEOUT = 5
+# Probe backends in the background and stop routing to unhealthy ones
+HEALTH_CHECKS = os.environ.get('HEALTH_CHECKS', '1') != '0'
+# Response bodies are relayed to the client in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Hop-by-hop headers describe a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade'
+}
+REQUEST_HEADERS_TO_DROP = HOP_BY_HOP_HEADERS | {'host', 'content-length'}
+RESPONSE_HEADERS_TO_DROP = HOP_BY_HOP_HEADERS
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# User id of /recommend/<user_id> requests, used for sticky routing
+RECOMMEND_PATH = re.compile(r'^/recommend/([^/]+)')
+
+# Only idempotent requests are hedged
+HEDGE_METHODS = {'GET', 'HEAD'}
+# Responses needed before a variant's latency percentile is trusted as hedge delay
+HEDGE_MIN_SAMPLES = 20
+
 # Load balancer configuration
 DEFAULT_CONFIG = {
     "variant_a": {
@@ -33,23 +73,33 @@ DEFAULT_CONFIG = {
     "monitoring": {
         "enabled": True,
         "log_level": "INFO"
-    }
-}
-
-# In-memory metrics
-metrics = {
-    "requests": {
-        "total": 0,
-        "variant_a": 0,
-        "variant_b": 0,
-        "errors": 0
     },
-    "latency": {
-        "variant_a": [],
-        "variant_b": []
+    "hedging": {
+        "enabled": False,
+        "percentile": 95,
+        "min_delay": 0.01,
+        "max_delay": 1.0
+    },
+    "coalescing": {
+        "enabled": False
+    },
+    "cache": {
+        "enabled": False,
+        "ttl": 2.0,
+        "max_entries": 10000
     }
 }
 
+# In-memory metrics: latency histograms per variant and status class
+metrics = RequestMetrics()
+
+# Probe results, circuit breakers and outlier ejection per variant
+health = HealthTracker()
+
+# Short-TTL responses, and identical GETs currently waiting for a backend
+response_cache = ResponseCache()
+coalescer = SingleFlight()
+
 def load_config():
     """Load the configuration from file or use default"""
     return DEFAULT_CONFIG
@@ -61,128 +111,441 @@ config = load_config()
 if config["monitoring"]["log_level"]:
     logging.getLogger().setLevel(config["monitoring"]["log_level"])
 
-def select_variant():
-    """Select a variant based on the configured weights"""
-    weight_a = config["variant_a"]["weight"]
-    weight_b = config["variant_b"]["weight"]
-    
-    # Normalize weights if they don't add up to 100
-    total_weight = weight_a + weight_b
-    if total_weight != 100:
-        weight_a = (weight_a / total_weight) * 100
-        weight_b = (weight_b / total_weight) * 100
-    
-    # Random selection based on weights
-    rand_val = random.uniform(0, 100)
-    if rand_val <= weight_a:
-        return "variant_a"
-    else:
-        return "variant_b"
+def get_variants(cfg=None):
+    """Return {name: settings} for every variant (entry with a service_url) in the configuration"""
+    if cfg is None:
+        cfg = config
+    return {
+        name: settings for name, settings in cfg.items()
+        if isinstance(settings, dict) and "service_url" in settings
+    }
+
+def user_from_path(path):
+    """Return the user id of a /recommend/<user_id> path, or None"""
+    match = RECOMMEND_PATH.match(path)
+    return match.group(1) if match else None
 
-def forward_request(variant, path, request_data):
-    """Forward the request to the selected variant"""
-    start_time = time.time()
+def _user_hash(variant, user_id):
+    """Deterministic number in (0, 1) for a (variant, user) pair"""
+    digest = hashlib.blake2b(f"{variant}\0{user_id}".encode(), digest_size=8).digest()
+    return (int.from_bytes(digest, 'big') + 0.5) / 2 ** 64
+
+def rank_variants(user_id=None):
+    """
+    Order the variants with a positive weight by preference for a request.
+    
+    Requests for a user are ranked with weighted rendezvous hashing: every
+    variant scores the user as -weight / ln(hash(variant, user)), highest
+    first. Each variant is the first choice of its weight's share of users, a
+    user always lands on the same variant (keeping its caches warm), and
+    changing one variant's weight only moves users to or from that variant.
+    Requests without a user id get a random first choice, drawn by weight.
+    """
+    weights = {name: settings["weight"] for name, settings in get_variants().items() if settings["weight"] > 0}
+    
+    if user_id is None:
+        first = random.choices(list(weights), weights=list(weights.values()))[0]
+        return [first] + [name for name in weights if name != first]
     
-    # Get the base URL for the selected variant
-    base_url = config[variant]["service_url"]
+    return sorted(weights, key=lambda name: -weights[name] / math.log(_user_hash(name, user_id)), reverse=True)
+
+def select_variants(user_id=None, count=1):
+    """
+    Return up to count available variants in the request's preference order,
+    so a user whose variant is unhealthy consistently falls back to the same one.
+    If no variant is available, the preferred one is tried anyway.
+    """
+    ranked = rank_variants(user_id)
+    selected = []
+    for name in ranked:
+        if health.available(name):
+            selected.append(name)
+            if len(selected) == count:
+                break
+    return selected or ranked[:1]
+
+def select_variant(user_id=None):
+    """Select the variant to send a request to"""
+    return select_variants(user_id)[0]
+
+def filter_headers(headers, excluded):
+    """Return the (name, value) pairs of headers whose name is not in excluded"""
+    return [(k, v) for k, v in headers.items() if k.lower() not in excluded]
+
+# One keep-alive session per service URL, so proxied requests reuse TCP
+# connections instead of opening a new one per call
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def get_session(base_url):
+    """Return the pooled session used to talk to a service URL"""
+    session = _sessions.get(base_url)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # The session is shared by all clients; never carry cookies between them
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                _sessions[base_url] = session
+    return session
+
+def hedging_settings(method):
+    """Return the hedging configuration if requests with this method are hedged, else None"""
+    hedging = config.get("hedging") or {}
+    if method not in HEDGE_METHODS or not hedging.get("enabled"):
+        return None
+    return hedging
+
+def hedge_delay(variant, hedging):
+    """How long to wait for variant before hedging: a percentile of its latency, clamped"""
+    min_delay = hedging.get("min_delay", 0.01)
+    max_delay = hedging.get("max_delay", 1.0)
+    delay = metrics.quantile(variant, hedging.get("percentile", 95) / 100, min_count=HEDGE_MIN_SAMPLES)
+    if delay is None:
+        return max_delay
+    return min(max(delay, min_delay), max_delay)
+
+def send_upstream(variant, base_url, path, outgoing):
+    """Send a request to one variant and return its response once the headers arrived"""
+    start_time = time.perf_counter()
     target_url = f"{base_url}{path}"
     
     # Log request details
     logger.info(f"Forwarding request to {variant}: {target_url}")
     
-    # Extract headers to forward (excluding hop-by-hop headers)
-    headers_to_forward = {
-        k: v for k, v in request.headers.items() 
-        if k.lower() not in ['host', 'connection', 'content-length', 'transfer-encoding']
+    try:
+        # stream=True returns as soon as the headers arrive; the body is relayed by the caller
+        response = get_session(base_url).request(url=target_url, timeout=UPSTREAM_TIMEOUT, stream=True, **outgoing)
+    except RequestException:
+        latency = time.perf_counter() - start_time
+        metrics.record_error(variant, latency)
+        health.record(variant, ok=False, latency=latency)
+        raise
+    
+    latency = time.perf_counter() - start_time
+    metrics.record_upstream(variant, response.status_code, latency)
+    health.record(variant, ok=response.status_code < 500, latency=latency)
+    logger.info(f"Response from {variant}: status={response.status_code}, latency={latency:.3f}s")
+    return response
+
+def _start_attempt(variant, base_url, path, outgoing):
+    """
+    Send a request to variant on a thread of its own and return a Future for
+    its response. Not a bounded pool: attempts stuck on a stalled backend must
+    never hold up other requests' attempts, least of all their hedges.
+    """
+    future = Future()
+    
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(send_upstream(variant, base_url, path, outgoing))
+        except BaseException as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=run, name=f'hedge-{variant}', daemon=True).start()
+    return future
+
+def _discard_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def send_hedged(primary, secondary, delay, base_urls, path, outgoing):
+    """
+    Send the request to primary and, if it has not answered within delay, to
+    secondary as well. Returns (variant, response) of the first good answer
+    (not a connection error or 5xx), or of the last failure if none is good.
+    """
+    attempts = {_start_attempt(primary, base_urls[primary], path, outgoing): primary}
+    done, _ = wait(attempts, timeout=delay)
+    if not done:
+        logger.info(f"No answer from {primary} after {delay:.3f}s, hedging to {secondary}")
+        attempts[_start_attempt(secondary, base_urls[secondary], path, outgoing)] = secondary
+    
+    winner = None
+    failures = []
+    pending = set(attempts)
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if winner is None and future.exception() is None and future.result().status_code < 500:
+                winner = future
+            else:
+                failures.append(future)
+    
+    if winner is None:
+        winner = failures.pop()
+    for future in failures:
+        _discard_response(future)
+    # Attempts still waiting for their backend release it whenever it answers
+    for future in pending:
+        future.add_done_callback(_discard_response)
+    
+    if len(attempts) > 1:
+        health.record_hedge(secondary, won=attempts[winner] == secondary)
+    return attempts[winner], winner.result()
+
+def sharing_settings(method):
+    """Return (coalescing enabled, cache settings or None) for a request"""
+    if method != 'GET':
+        return False, None
+    coalescing = (config.get("coalescing") or {}).get("enabled", False)
+    cache = config.get("cache") or {}
+    return coalescing, cache if cache.get("enabled") else None
+
+def fetch(variants, base_urls, path, outgoing, hedging):
+    """Send the request upstream, hedging if enabled; returns (variant, response)"""
+    if hedging and len(variants) > 1:
+        delay = hedge_delay(variants[0], hedging)
+        return send_hedged(variants[0], variants[1], delay, base_urls, path, outgoing)
+    return variants[0], send_upstream(variants[0], base_urls[variants[0]], path, outgoing)
+
+def fetch_shared(variants, base_urls, path, outgoing, hedging):
+    """Fetch a response and buffer it for sharing, unless it is larger than MAX_SHARED_BODY"""
+    variant, response = fetch(variants, base_urls, path, outgoing, hedging)
+    chunks = response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+    
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > MAX_SHARED_BODY:
+        return UnsharedResponse(variant, response, b'', chunks)
+    
+    body = bytearray()
+    try:
+        for chunk in chunks:
+            body += chunk
+            if len(body) > MAX_SHARED_BODY:
+                return UnsharedResponse(variant, response, bytes(body), chunks)
+    except UpstreamBodyError as e:
+        response.close()
+        raise RequestException(f"Error reading response body: {str(e)}")
+    
+    # The body was read to the end, so this returns the connection to the pool
+    response.close()
+    headers = filter_headers(response.headers, RESPONSE_HEADERS_TO_DROP)
+    return SharedResponse(variant, response.status_code, headers, bytes(body))
+
+def stream_response(variant, response, start_time, prefix=b'', chunks=None):
+    """Relay an upstream response to the client as it arrives"""
+    if chunks is None:
+        # Pass the body through undecoded, so Content-Encoding/Content-Length stay valid
+        chunks = response.raw.stream(STREAM_CHUNK_SIZE, decode_content=False)
+    
+    def generate():
+        try:
+            if prefix:
+                yield prefix
+            yield from chunks
+        finally:
+            # The connection goes back to the pool once the body was read to the end
+            response.close()
+            metrics.record_total(variant, response.status_code, time.perf_counter() - start_time)
+    
+    # Return the response with the same status code and headers, streaming the content
+    headers = filter_headers(response.headers, RESPONSE_HEADERS_TO_DROP)
+    headers.append(('X-Served-By', variant))
+    return Response(
+        stream_with_context(generate()),
+        status=response.status_code,
+        headers=headers
+    )
+
+def replay_response(shared, cache_status, start_time):
+    """Answer with a buffered response; X-Cache tells whether it came from the cache or another request"""
+    # Every client request gets a total time, also when it did not call the backend itself
+    metrics.record_total(shared.variant, shared.status, time.perf_counter() - start_time)
+    headers = shared.headers + [('X-Served-By', shared.variant), ('X-Cache', cache_status)]
+    return Response(shared.body, status=shared.status, headers=headers)
+
+def forward_request(variants, path, request_data, hedging=None):
+    """
+    Forward the request to the first of the selected variants, hedging to
+    the second one if hedging is enabled. Identical GETs share one upstream
+    call while it is in flight and, if the cache is enabled, for a short TTL.
+    """
+    start_time = time.perf_counter()
+    base_urls = {variant: config[variant]["service_url"] for variant in variants}
+    
+    # Forward the request with the same method, headers, and data
+    outgoing = {
+        "method": request.method,
+        "headers": dict(filter_headers(request.headers, REQUEST_HEADERS_TO_DROP)),
+        "params": list(request.args.items(multi=True)),
+        "data": request_data,
+        "cookies": request.cookies
     }
     
+    coalescing, cache = sharing_settings(request.method)
+    key = None
+    if coalescing or cache:
+        key = share_key(variants[0], f"{path}?{request.query_string.decode()}", request.headers)
+    
     try:
-        # Forward the request with the same method, headers, and data
-        response = requests.request(
-            method=request.method,
-            url=target_url,
-            headers=headers_to_forward,
-            params=request.args,
-            data=request_data,
-            cookies=request.cookies,
-            timeout=30  # 30 second timeout
-        )
+        if key is None:
+            variant, response = fetch(variants, base_urls, path, outgoing, hedging)
+            return stream_response(variant, response, start_time)
+        
+        if cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                return replay_response(cached, 'HIT', start_time)
         
-        # Update metrics
-        metrics["requests"]["total"] += 1
-        metrics["requests"][variant] += 1
+        generation = response_cache.generation
         
-        # Record latency
-        latency = time.time() - start_time
-        metrics["latency"][variant].append(latency)
-        # Keep only the last 1000 latency records
-        if len(metrics["latency"][variant]) > 1000:
-            metrics["latency"][variant] = metrics["latency"][variant][-1000:]
+        def fetch_for_sharing():
+            return fetch_shared(variants, base_urls, path, outgoing, hedging)
         
-        # Log response info
-        logger.info(f"Response from {variant}: status={response.status_code}, latency={latency:.3f}s")
+        if coalescing:
+            result, leader = coalescer.do(key, fetch_for_sharing)
+        else:
+            result, leader = fetch_for_sharing(), True
         
-        # Return the response with the same status code, headers, and content
-        return Response(
-            response.content,
-            status=response.status_code,
-            headers={k: v for k, v in response.headers.items() 
-                     if k.lower() not in ['transfer-encoding']}
-        )
+        if isinstance(result, SharedResponse):
+            if leader and cache and result.cacheable():
+                response_cache.put(key, result, cache.get("ttl", 2.0), cache.get("max_entries", 10000), generation)
+            return replay_response(result, 'MISS' if leader else 'COALESCED', start_time)
         
+        if leader:
+            return stream_response(result.variant, result.response, start_time, result.prefix, result.rest)
+        
+        # Too large to share: fetch our own copy
+        variant, response = fetch(variants, base_urls, path, outgoing, hedging)
+        return stream_response(variant, response, start_time)
+    
     except RequestException as e:
         # Handle request errors
-        logger.error(f"Error forwarding request to {variant}: {str(e)}")
-        metrics["requests"]["errors"] += 1
+        logger.error(f"Error forwarding request to {variants[0]}: {str(e)}")
         return jsonify({
             "error": "Failed to reach service",
             "details": str(e)
         }), 503
 
-@app.route('/status')
-def status_check():
-    """Status check endpoint"""
-    # Check both services
-    services_status = {}
-    
+def service_status(status_code, text):
+    """Describe a backend from its /status response"""
+    return {
+        "status": "up" if status_code == 200 else "degraded",
+        "status_code": status_code,
+        "response": text
+    }
+
+def overall_status(services_status):
+    """Combine per-service status into the balancer's (message, status code)"""
+    up = [service["status"] == "up" for service in services_status.values()]
+    if all(up):
+        return "OK", 200
+    elif any(up):
+        return "DEGRADED - Some services unavailable", 200
+    else:
+        return "CRITICAL - All services down", 500
+
+def probe_service(base_url):
+    """Query a service's /status endpoint"""
     try:
-        response_a = requests.get(f"{config['variant_a']['service_url']}/status", timeout=5)
-        services_status["service_a"] = {
-            "status": "up" if response_a.status_code == 200 else "degraded",
-            "status_code": response_a.status_code,
-            "response": response_a.text
-        }
+        response = get_session(base_url).get(f"{base_url}/status", timeout=STATUS_TIMEOUT)
+        return service_status(response.status_code, response.text)
     except Exception as e:
-        services_status["service_a"] = {
+        return {
             "status": "down",
             "error": str(e)
         }
+
+_probe_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='probe')
+
+def probe_variants():
+    """Probe every variant concurrently and record the results"""
+    variants = get_variants()
+    results = dict(zip(variants, _probe_pool.map(probe_service, [s["service_url"] for s in variants.values()])))
+    for variant, result in results.items():
+        health.record_probe(variant, result)
+    return results
+
+def run_health_checks():
+    """One round of background health checking: probes, then outlier ejection"""
+    variants = probe_variants()
+    health.sweep(list(variants))
+
+def start_health_checks():
+    """Start background health checking, unless disabled with HEALTH_CHECKS=0"""
+    if HEALTH_CHECKS:
+        health.start(run_health_checks)
+
+def metrics_summary(single_flight=None):
+    """Return the metrics reported by /metrics; single_flight is the proxy engine's coalescer"""
+    variants = metrics.summary()
+    empty = {"responses": 0, "requests": 0, "upstream": {"mean": None}}
+    variant_a = variants.get("variant_a", empty)
+    variant_b = variants.get("variant_b", empty)
     
-    try:
-        response_b = requests.get(f"{config['variant_b']['service_url']}/status", timeout=5)
-        services_status["service_b"] = {
-            "status": "up" if response_b.status_code == 200 else "degraded",
-            "status_code": response_b.status_code,
-            "response": response_b.text
-        }
-    except Exception as e:
-        services_status["service_b"] = {
-            "status": "down",
-            "error": str(e)
-        }
+    # Requests that got a response from a backend; unreachable ones count as errors
+    total = sum(v["responses"] for v in variants.values())
+    errors = sum(v["requests"] - v["responses"] for v in variants.values())
     
-    # Determine overall status
-    if services_status["service_a"]["status"] == "up" and services_status["service_b"]["status"] == "up":
-        overall_status = "OK"
-        status_code = 200
-    elif services_status["service_a"]["status"] == "up" or services_status["service_b"]["status"] == "up":
-        overall_status = "DEGRADED - Some services unavailable"
-        status_code = 200
-    else:
-        overall_status = "CRITICAL - All services down"
-        status_code = 500
+    return {
+        "total_requests": total,
+        "variant_a_requests": variant_a["responses"],
+        "variant_b_requests": variant_b["responses"],
+        "errors": errors,
+        "variant_a_percentage": (variant_a["responses"] / max(total, 1)) * 100,
+        "variant_b_percentage": (variant_b["responses"] / max(total, 1)) * 100,
+        # Average time until the backend answered
+        "variant_a_avg_latency": variant_a["upstream"]["mean"] or 0,
+        "variant_b_avg_latency": variant_b["upstream"]["mean"] or 0,
+        # Per variant: status class counts, error rate, upstream/total latency percentiles
+        "variants": variants,
+        # Per variant: probe status, circuit breaker, ejection, hedged requests
+        "health": health.summary(get_variants()),
+        # Response cache hit rate and share of GETs coalesced onto another request's upstream call
+        "cache": {**response_cache.stats(), **(single_flight or coalescer).stats()},
+        "config": config
+    }
+
+def reset_all_metrics(single_flight=None):
+    """Clear latency histograms and cache/coalescing counters"""
+    metrics.reset()
+    response_cache.reset_stats()
+    (single_flight or coalescer).reset_stats()
+
+def validate_config(new_config):
+    """Return an error message if new_config is not a usable configuration"""
+    if not isinstance(new_config, dict) or not get_variants(new_config):
+        return "Invalid configuration: missing variant data"
+    
+    weights = [settings.get("weight") for settings in get_variants(new_config).values()]
+    if not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w >= 0 for w in weights):
+        return "Invalid configuration: weights must be non-negative numbers"
+    if sum(weights) <= 0:
+        return "Invalid configuration: at least one variant needs a positive weight"
+    return None
+
+def update_config(new_config):
+    """Replace the configuration with a validated new_config"""
+    global config
+    config = new_config
+    
+    # Cached responses may come from variants or settings that just changed
+    response_cache.clear()
+    
+    # Update log level if changed
+    if "monitoring" in config and "log_level" in config["monitoring"]:
+        logging.getLogger().setLevel(config["monitoring"]["log_level"])
+    
+    logger.info("Configuration updated")
+
+
+@app.route('/status')
+def status_check():
+    """Status check endpoint"""
+    # Recent background probe of each service; probe now if there is none
+    services_status = health.probe_results(get_variants())
+    if services_status is None:
+        services_status = probe_variants()
     
-    return Response(overall_status, status=status_code)
+    # Determine overall status
+    message, status_code = overall_status(services_status)
+    return Response(message, status=status_code)
 
 @app.route('/metrics')
 def get_metrics():
@@ -190,28 +553,20 @@ def get_metrics():
     if not config["monitoring"]["enabled"]:
         return jsonify({"error": "Monitoring is disabled"}), 403
     
-    # Calculate average latency for each variant
-    avg_latency_a = sum(metrics["latency"]["variant_a"]) / max(len(metrics["latency"]["variant_a"]), 1)
-    avg_latency_b = sum(metrics["latency"]["variant_b"]) / max(len(metrics["latency"]["variant_b"]), 1)
-    
     # Return formatted metrics
-    return jsonify({
-        "total_requests": metrics["requests"]["total"],
-        "variant_a_requests": metrics["requests"]["variant_a"],
-        "variant_b_requests": metrics["requests"]["variant_b"],
-        "errors": metrics["requests"]["errors"],
-        "variant_a_percentage": (metrics["requests"]["variant_a"] / max(metrics["requests"]["total"], 1)) * 100,
-        "variant_b_percentage": (metrics["requests"]["variant_b"] / max(metrics["requests"]["total"], 1)) * 100,
-        "variant_a_avg_latency": avg_latency_a,
-        "variant_b_avg_latency": avg_latency_b,
-        "config": config
-    })
+    return jsonify(metrics_summary())
+
+@app.route('/metrics/prometheus')
+def get_prometheus_metrics():
+    """Metrics in the Prometheus text exposition format"""
+    if not config["monitoring"]["enabled"]:
+        return Response("Monitoring is disabled\n", status=403, mimetype='text/plain')
+    
+    return Response(metrics.prometheus(), content_type=PROMETHEUS_CONTENT_TYPE)
 
 @app.route('/config', methods=['GET', 'POST'])
 def manage_config():
     """Endpoint to get or update configuration"""
-    global config
-    
     if request.method == 'GET':
         return jsonify(config)
     
@@ -220,17 +575,12 @@ def manage_config():
             new_config = request.json
             
             # Validate new config
-            if "variant_a" not in new_config or "variant_b" not in new_config:
-                return jsonify({"error": "Invalid configuration: missing variant data"}), 400
+            error = validate_config(new_config)
+            if error:
+                return jsonify({"error": error}), 400
             
             # Update config
-            config = new_config
-            
-            # Update log level if changed
-            if "monitoring" in config and "log_level" in config["monitoring"]:
-                logging.getLogger().setLevel(config["monitoring"]["log_level"])
-            
-            logger.info("Configuration updated")
+            update_config(new_config)
             return jsonify({"message": "Configuration updated successfully", "config": config})
             
         except Exception as e:
@@ -245,38 +595,29 @@ def health_check():
 @app.route('/reset_metrics', methods=['POST'])
 def reset_metrics():
     """Reset the metrics counters"""
-    global metrics
-    metrics = {
-        "requests": {
-            "total": 0,
-            "variant_a": 0,
-            "variant_b": 0,
-            "errors": 0
-        },
-        "latency": {
-            "variant_a": [],
-            "variant_b": []
-        }
-    }
+    reset_all_metrics()
     return jsonify({"message": "Metrics reset successfully"})
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS'])
 def proxy(path):
     """Main proxy endpoint that handles all requests"""
-    # Select variant A or B based on configured weights
-    variant = select_variant()
+    # Select a healthy variant based on configured weights, keeping each user on the same one,
+    # plus the user's next choice when the request may be hedged
+    hedging = hedging_settings(request.method)
+    variants = select_variants(user_from_path(f"/{path}"), count=2 if hedging else 1)
     
     # Get request data
     request_data = request.get_data()
     
     # Forward the request to the selected variant
-    return forward_request(variant, f"/{path}", request_data)
+    return forward_request(variants, f"/{path}", request_data, hedging)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8082))
     logger.info(f"Starting A/B testing load balancer on port {port}")
-    logger.info(f"Variant A weight: {config['variant_a']['weight']}%, URL: {config['variant_a']['service_url']}")
-    logger.info(f"Variant B weight: {config['variant_b']['weight']}%, URL: {config['variant_b']['service_url']}")
+    for name, settings in get_variants().items():
+        logger.info(f"{name} weight: {settings['weight']}, URL: {settings['service_url']}")
     
+    start_health_checks()
     app.run(host='0.0.0.0', port=port, debug=False)
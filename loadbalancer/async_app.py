@@ -0,0 +1,394 @@
+"""
+asyncio proxy engine for the A/B load balancer.
+
+Serves the same API as the Flask app in app.py, whose configuration and
+metrics it shares, but runs on a single event loop:
+- every variant's service is reached through a persistent aiohttp connection
+  pool, so requests reuse keep-alive connections,
+- at most MAX_CONCURRENCY upstream requests are in flight at once, the rest
+  wait for a slot,
+- response bodies are relayed to the client chunk by chunk as they arrive.
+Variant selection, health tracking and hedging follow the same rules as in app.py.
+
+Run with `python async_app.py` (or PROXY_MODE=async in the Docker image).
+"""
+import os
+import asyncio
+import logging
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from yarl import URL
+
+import app as lb
+from response_cache import MAX_SHARED_BODY, AsyncSingleFlight, SharedResponse, UnsharedResponse, share_key
+
+logger = logging.getLogger('ab-loadbalancer')
+
+# Upper bound on upstream requests in flight across all variants
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', 256))
+# Idle keep-alive connections are closed after this many seconds
+KEEPALIVE_TIMEOUT = 60
+
+
+class UpstreamPools:
+    """Keep-alive aiohttp sessions, one per service URL, plus the concurrency limit"""
+
+    def __init__(self, pool_size=lb.POOL_SIZE, max_concurrency=MAX_CONCURRENCY):
+        self.pool_size = pool_size
+        self.limit = asyncio.Semaphore(max_concurrency)
+        self._sessions = {}
+
+    def session(self, base_url):
+        session = self._sessions.get(base_url)
+        if session is None:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=KEEPALIVE_TIMEOUT),
+                # Bodies are passed through as-is, so Content-Encoding stays valid
+                auto_decompress=False,
+                # Sessions are shared by all clients; never carry cookies between them
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=lb.UPSTREAM_TIMEOUT,
+                    sock_read=lb.UPSTREAM_TIMEOUT
+                )
+            )
+            self._sessions[base_url] = session
+        return session
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+pools_key = web.AppKey('pools', UpstreamPools)
+
+# Identical GETs in flight share one upstream call, run as a task on the event loop
+coalescer = AsyncSingleFlight()
+
+
+# Hedged requests that lost but are still waiting for their backend
+_background = set()
+
+
+async def send_upstream(pools, variant, base_url, request, request_data):
+    """Send the request to one variant and return its response once the headers arrived"""
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    # raw_path keeps the original path and query string encoding
+    target_url = URL(f"{base_url}{request.raw_path}", encoded=True)
+    logger.info(f"Forwarding request to {variant}: {target_url}")
+
+    try:
+        upstream = await pools.session(base_url).request(
+            request.method,
+            target_url,
+            headers=lb.filter_headers(request.headers, lb.REQUEST_HEADERS_TO_DROP),
+            data=request_data
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        latency = loop.time() - start_time
+        lb.metrics.record_error(variant, latency)
+        lb.health.record(variant, ok=False, latency=latency)
+        raise
+
+    latency = loop.time() - start_time
+    lb.metrics.record_upstream(variant, upstream.status, latency)
+    lb.health.record(variant, ok=upstream.status < 500, latency=latency)
+    logger.info(f"Response from {variant}: status={upstream.status}, latency={latency:.3f}s")
+    return upstream
+
+
+def _discard_response(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().release()
+
+
+async def send_hedged(pools, primary, secondary, delay, base_urls, request, request_data):
+    """
+    Send the request to primary and, if it has not answered within delay, to
+    secondary as well. Returns (variant, response) of the first good answer
+    (not a connection error or 5xx), or of the last failure if none is good.
+    """
+    attempts = {
+        asyncio.ensure_future(send_upstream(pools, primary, base_urls[primary], request, request_data)): primary
+    }
+    done, _ = await asyncio.wait(attempts, timeout=delay)
+    if not done:
+        logger.info(f"No answer from {primary} after {delay:.3f}s, hedging to {secondary}")
+        hedge = asyncio.ensure_future(send_upstream(pools, secondary, base_urls[secondary], request, request_data))
+        attempts[hedge] = secondary
+
+    winner = None
+    failures = []
+    pending = set(attempts)
+    while pending and winner is None:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if winner is None and task.exception() is None and task.result().status < 500:
+                winner = task
+            else:
+                failures.append(task)
+
+    if winner is None:
+        winner = failures.pop()
+    for task in failures:
+        _discard_response(task)
+    # Attempts still waiting for their backend release it whenever it answers,
+    # so its health is still judged on the full response time
+    for task in pending:
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+        task.add_done_callback(_discard_response)
+
+    if len(attempts) > 1:
+        lb.health.record_hedge(secondary, won=attempts[winner] == secondary)
+    return attempts[winner], winner.result()
+
+
+async def fetch(pools, variants, base_urls, request, request_data, hedging):
+    """Send the request upstream, hedging if enabled; returns (variant, response)"""
+    if hedging and len(variants) > 1:
+        delay = lb.hedge_delay(variants[0], hedging)
+        return await send_hedged(pools, variants[0], variants[1], delay, base_urls, request, request_data)
+    return variants[0], await send_upstream(pools, variants[0], base_urls[variants[0]], request, request_data)
+
+
+async def fetch_shared(pools, variants, base_urls, request, request_data, hedging):
+    """Fetch a response and buffer it for sharing, unless it is larger than MAX_SHARED_BODY"""
+    variant, upstream = await fetch(pools, variants, base_urls, request, request_data, hedging)
+    if upstream.content_length is not None and upstream.content_length > MAX_SHARED_BODY:
+        return UnsharedResponse(variant, upstream, b'', upstream.content)
+
+    body = bytearray()
+    try:
+        async for chunk in upstream.content.iter_chunked(lb.STREAM_CHUNK_SIZE):
+            body += chunk
+            if len(body) > MAX_SHARED_BODY:
+                return UnsharedResponse(variant, upstream, bytes(body), upstream.content)
+    except BaseException:
+        upstream.release()
+        raise
+
+    upstream.release()
+    headers = lb.filter_headers(upstream.headers, lb.RESPONSE_HEADERS_TO_DROP)
+    return SharedResponse(variant, upstream.status, headers, bytes(body))
+
+
+async def stream_response(request, variant, upstream, start_time, prefix=b''):
+    """Relay an upstream response to the client as it arrives"""
+    try:
+        headers = CIMultiDict(lb.filter_headers(upstream.headers, lb.RESPONSE_HEADERS_TO_DROP))
+        headers['X-Served-By'] = variant
+        response = web.StreamResponse(status=upstream.status, reason=upstream.reason, headers=headers)
+        await response.prepare(request)
+        if prefix:
+            await response.write(prefix)
+        async for chunk in upstream.content.iter_chunked(lb.STREAM_CHUNK_SIZE):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+    finally:
+        # Returns the connection to the pool if the body was read, closes it otherwise
+        upstream.release()
+        lb.metrics.record_total(variant, upstream.status, asyncio.get_running_loop().time() - start_time)
+
+
+def replay_response(shared, cache_status, start_time):
+    """Answer with a buffered response; X-Cache tells whether it came from the cache or another request"""
+    # Every client request gets a total time, also when it did not call the backend itself
+    lb.metrics.record_total(shared.variant, shared.status, asyncio.get_running_loop().time() - start_time)
+    headers = CIMultiDict(shared.headers)
+    headers['X-Served-By'] = shared.variant
+    headers['X-Cache'] = cache_status
+    # The body length is set from the buffered body
+    headers.popall('Content-Length', None)
+    return web.Response(body=shared.body, status=shared.status, headers=headers)
+
+
+async def forward_request(request, variants, hedging=None):
+    """
+    Forward the request to the first of the selected variants, hedging to
+    the second one if hedging is enabled, and stream the response back.
+    Identical GETs share one upstream call while it is in flight and, if the
+    cache is enabled, for a short TTL.
+    """
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    base_urls = {variant: lb.config[variant]["service_url"] for variant in variants}
+
+    pools = request.app[pools_key]
+    request_data = await request.read() if request.body_exists else None
+
+    coalescing, cache = lb.sharing_settings(request.method)
+    key = None
+    if coalescing or cache:
+        key = share_key(variants[0], request.raw_path, request.headers)
+
+    if cache and key is not None:
+        cached = lb.response_cache.get(key)
+        if cached is not None:
+            return replay_response(cached, 'HIT', start_time)
+
+    try:
+        if key is None:
+            async with pools.limit:
+                variant, upstream = await fetch(pools, variants, base_urls, request, request_data, hedging)
+                return await stream_response(request, variant, upstream, start_time)
+
+        generation = lb.response_cache.generation
+
+        async def fetch_for_sharing():
+            # Only the request that calls upstream takes a concurrency slot. For a
+            # response too large to share, the slot goes with the open response
+            # and is freed once that has been streamed or abandoned.
+            await pools.limit.acquire()
+            try:
+                result = await fetch_shared(pools, variants, base_urls, request, request_data, hedging)
+            except BaseException:
+                pools.limit.release()
+                raise
+            if isinstance(result, SharedResponse):
+                pools.limit.release()
+            return result
+
+        def abandon(result):
+            # The client that started the call left before streaming its response
+            if isinstance(result, UnsharedResponse):
+                result.response.release()
+                pools.limit.release()
+
+        if coalescing:
+            result, leader = await coalescer.do(key, fetch_for_sharing, on_abandoned=abandon)
+        else:
+            result, leader = await fetch_for_sharing(), True
+
+        if isinstance(result, SharedResponse):
+            if leader and cache and result.cacheable():
+                lb.response_cache.put(
+                    key, result, cache.get("ttl", 2.0), cache.get("max_entries", 10000), generation
+                )
+            return replay_response(result, 'MISS' if leader else 'COALESCED', start_time)
+
+        if leader:
+            try:
+                return await stream_response(request, result.variant, result.response, start_time, result.prefix)
+            finally:
+                pools.limit.release()
+
+        # Too large to share: fetch our own copy
+        async with pools.limit:
+            variant, upstream = await fetch(pools, variants, base_urls, request, request_data, hedging)
+            return await stream_response(request, variant, upstream, start_time)
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Error forwarding request to {variants[0]}: {str(e)}")
+        return web.json_response({
+            "error": "Failed to reach service",
+            "details": str(e)
+        }, status=503)
+
+
+async def status_check(request):
+    """Status check endpoint"""
+    # Recent background probe of each service; probe now if there is none
+    services_status = lb.health.probe_results(lb.get_variants())
+    if services_status is None:
+        services_status = await asyncio.get_running_loop().run_in_executor(None, lb.probe_variants)
+    message, status_code = lb.overall_status(services_status)
+    return web.Response(text=message, status=status_code)
+
+
+async def get_metrics(request):
+    """Endpoint to retrieve current metrics"""
+    if not lb.config["monitoring"]["enabled"]:
+        return web.json_response({"error": "Monitoring is disabled"}, status=403)
+    return web.json_response(lb.metrics_summary(coalescer))
+
+
+async def get_prometheus_metrics(request):
+    """Metrics in the Prometheus text exposition format"""
+    if not lb.config["monitoring"]["enabled"]:
+        return web.Response(text="Monitoring is disabled\n", status=403)
+    return web.Response(body=lb.metrics.prometheus().encode(), headers={"Content-Type": lb.PROMETHEUS_CONTENT_TYPE})
+
+
+async def get_config(request):
+    """Endpoint to get the configuration"""
+    return web.json_response(lb.config)
+
+
+async def post_config(request):
+    """Endpoint to update the configuration"""
+    try:
+        new_config = await request.json()
+
+        error = lb.validate_config(new_config)
+        if error:
+            return web.json_response({"error": error}, status=400)
+
+        lb.update_config(new_config)
+        return web.json_response({"message": "Configuration updated successfully", "config": lb.config})
+
+    except Exception as e:
+        logger.error(f"Error updating configuration: {str(e)}")
+        return web.json_response({"error": f"Failed to update configuration: {str(e)}"}, status=400)
+
+
+async def health_check(request):
+    """Health check endpoint"""
+    return web.json_response({"status": "healthy"})
+
+
+async def reset_metrics(request):
+    """Reset the metrics counters"""
+    lb.reset_all_metrics(coalescer)
+    return web.json_response({"message": "Metrics reset successfully"})
+
+
+async def proxy(request):
+    """Main proxy endpoint that handles all requests"""
+    # Select a healthy variant based on configured weights, keeping each user on the same one,
+    # plus the user's next choice when the request may be hedged
+    hedging = lb.hedging_settings(request.method)
+    variants = lb.select_variants(lb.user_from_path(request.path), count=2 if hedging else 1)
+    return await forward_request(request, variants, hedging)
+
+
+async def _open_pools(application):
+    application[pools_key] = UpstreamPools()
+    lb.start_health_checks()
+
+
+async def _close_pools(application):
+    await application[pools_key].close()
+
+
+def create_app():
+    """Build the aiohttp application"""
+    application = web.Application()
+    application.on_startup.append(_open_pools)
+    application.on_cleanup.append(_close_pools)
+    application.add_routes([
+        web.get('/status', status_check),
+        web.get('/metrics', get_metrics),
+        web.get('/metrics/prometheus', get_prometheus_metrics),
+        web.get('/config', get_config),
+        web.post('/config', post_config),
+        web.get('/health', health_check),
+        web.post('/reset_metrics', reset_metrics),
+        web.route('*', '/{path:.*}', proxy),
+    ])
+    return application
+
+
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 8082))
+    logger.info(f"Starting asyncio A/B testing load balancer on port {port}")
+    for name, settings in lb.get_variants().items():
+        logger.info(f"{name} weight: {settings['weight']}, URL: {settings['service_url']}")
+
+    web.run_app(create_app(), host='0.0.0.0', port=port, access_log=None, print=None)
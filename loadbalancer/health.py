@@ -0,0 +1,267 @@
+"""
+Backend health tracking for the A/B load balancer.
+
+A variant only gets traffic while all three of these agree it is usable:
+- active probing: a background thread polls every variant's /status; a
+  variant is marked down after UNHEALTHY_PROBES failed probes in a row and up
+  again after one successful probe,
+- circuit breaker: BREAKER_FAILURES failed requests in a row (connection
+  errors, timeouts, 5xx) open the variant's breaker for BREAKER_RESET
+  seconds; after that a single trial request is let through, and its outcome
+  closes the breaker or opens it again,
+- outlier ejection: after every probe round, a variant whose error rate or
+  mean latency since the previous round is far worse than its peers' is
+  ejected for EJECTION_TIME seconds, longer each time it is ejected again.
+  The last available variant is never ejected.
+"""
+import os
+import time
+import logging
+import threading
+import statistics
+
+logger = logging.getLogger('ab-loadbalancer')
+
+PROBE_INTERVAL = float(os.environ.get('PROBE_INTERVAL', 5))
+UNHEALTHY_PROBES = int(os.environ.get('UNHEALTHY_PROBES', 2))
+BREAKER_FAILURES = int(os.environ.get('BREAKER_FAILURES', 5))
+BREAKER_RESET = float(os.environ.get('BREAKER_RESET', 10))
+EJECTION_TIME = float(os.environ.get('EJECTION_TIME', 30))
+# Outlier ejection only judges variants with at least this many requests in a round
+EJECTION_MIN_REQUESTS = int(os.environ.get('EJECTION_MIN_REQUESTS', 20))
+EJECTION_ERROR_RATE = float(os.environ.get('EJECTION_ERROR_RATE', 0.5))
+# Ejected when mean latency exceeds this multiple of the other variants' median
+EJECTION_LATENCY_FACTOR = float(os.environ.get('EJECTION_LATENCY_FACTOR', 3))
+# ...and is at least this slow (seconds), so fast variants are not ejected over noise
+EJECTION_MIN_LATENCY = float(os.environ.get('EJECTION_MIN_LATENCY', 0.05))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker driven by consecutive failures; not thread-safe"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._trial_started = None
+
+    def allow(self):
+        """Whether a request may be sent now. Half-open breakers allow one trial at a time."""
+        if self.state == self.CLOSED:
+            return True
+        now = self._clock()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_started = None
+        # A trial whose outcome never arrived (e.g. the request was not sent) expires
+        if self._trial_started is None or now - self._trial_started >= self.reset_timeout:
+            self._trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = self._clock()
+            self._trial_started = None
+
+
+class VariantHealth:
+    """Everything the tracker knows about one variant"""
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.probe_up = True
+        self.probe_failures = 0
+        self.last_probe = None
+        self.probed_at = None
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        # Outcomes since the last outlier sweep
+        self.requests = 0
+        self.failures = 0
+        self.latency_sum = 0.0
+
+
+class HealthTracker:
+    """Thread-safe health state of every variant"""
+
+    def __init__(self, unhealthy_probes=UNHEALTHY_PROBES, breaker_failures=BREAKER_FAILURES,
+                 breaker_reset=BREAKER_RESET, ejection_time=EJECTION_TIME,
+                 ejection_min_requests=EJECTION_MIN_REQUESTS, ejection_error_rate=EJECTION_ERROR_RATE,
+                 ejection_latency_factor=EJECTION_LATENCY_FACTOR, ejection_min_latency=EJECTION_MIN_LATENCY,
+                 clock=time.monotonic):
+        self.unhealthy_probes = unhealthy_probes
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.ejection_time = ejection_time
+        self.ejection_min_requests = ejection_min_requests
+        self.ejection_error_rate = ejection_error_rate
+        self.ejection_latency_factor = ejection_latency_factor
+        self.ejection_min_latency = ejection_min_latency
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._variants = {}
+        self._thread = None
+        self._interval = None
+
+    def _get(self, variant):
+        health = self._variants.get(variant)
+        if health is None:
+            breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset, self._clock)
+            health = self._variants[variant] = VariantHealth(breaker)
+        return health
+
+    def _usable(self, health, now):
+        return health.probe_up and now >= health.ejected_until and health.breaker.state != CircuitBreaker.OPEN
+
+    def available(self, variant):
+        """
+        Whether a request may be sent to variant now. For a half-open breaker
+        this takes its trial slot, so only call it for a request about to be sent.
+        """
+        with self._lock:
+            health = self._get(variant)
+            if not health.probe_up or self._clock() < health.ejected_until:
+                return False
+            return health.breaker.allow()
+
+    def record(self, variant, ok, latency):
+        """Record the outcome of one request to variant"""
+        with self._lock:
+            health = self._get(variant)
+            health.requests += 1
+            health.latency_sum += latency
+            if ok:
+                health.breaker.record_success()
+            else:
+                health.failures += 1
+                state = health.breaker.state
+                health.breaker.record_failure()
+                if state != CircuitBreaker.OPEN and health.breaker.state == CircuitBreaker.OPEN:
+                    logger.warning(f"Circuit breaker for {variant} opened after {health.breaker.failures} failures")
+
+    def record_hedge(self, variant, won):
+        """Count a hedged request sent to variant, and whether its answer was used"""
+        with self._lock:
+            health = self._get(variant)
+            health.hedges += 1
+            health.hedges_won += int(won)
+
+    def record_probe(self, variant, result):
+        """Record a /status probe result (a dict with a "status" of up, degraded or down)"""
+        with self._lock:
+            health = self._get(variant)
+            health.last_probe = result
+            health.probed_at = self._clock()
+            if result["status"] == "up":
+                if not health.probe_up:
+                    logger.info(f"{variant} is up again")
+                health.probe_up = True
+                health.probe_failures = 0
+            else:
+                health.probe_failures += 1
+                if health.probe_up and health.probe_failures >= self.unhealthy_probes:
+                    logger.warning(f"{variant} marked down after {health.probe_failures} failed probes")
+                    health.probe_up = False
+
+    def probe_results(self, variants):
+        """
+        Last background probe result per variant, or None unless the probe
+        thread is running and every variant was probed within two intervals
+        """
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                return None
+            now = self._clock()
+            results = {}
+            for variant in variants:
+                health = self._get(variant)
+                if health.probed_at is None or now - health.probed_at > 2 * self._interval:
+                    return None
+                results[variant] = health.last_probe
+            return results
+
+    def sweep(self, variants):
+        """Eject outliers among variants based on the requests since the previous sweep"""
+        with self._lock:
+            now = self._clock()
+            stats = {}
+            for variant in variants:
+                health = self._get(variant)
+                if health.requests >= self.ejection_min_requests:
+                    stats[variant] = (health.failures / health.requests, health.latency_sum / health.requests)
+
+            usable = sum(self._usable(self._get(variant), now) for variant in variants)
+            for variant, (error_rate, latency) in stats.items():
+                health = self._get(variant)
+                others = [stat[1] for name, stat in stats.items() if name != variant]
+                slow = (others and latency >= self.ejection_min_latency
+                        and latency > self.ejection_latency_factor * statistics.median(others))
+                if not (error_rate >= self.ejection_error_rate or slow):
+                    # A good round after coming back forgets earlier ejections
+                    if now >= health.ejected_until:
+                        health.ejections = 0
+                elif self._usable(health, now) and usable > 1:
+                    health.ejections += 1
+                    health.ejected_until = now + self.ejection_time * health.ejections
+                    usable -= 1
+                    logger.warning(f"Ejected {variant} for {self.ejection_time * health.ejections:.0f}s "
+                                   f"(error rate {error_rate:.0%}, mean latency {latency:.3f}s)")
+
+            for variant in variants:
+                health = self._get(variant)
+                health.requests = 0
+                health.failures = 0
+                health.latency_sum = 0.0
+
+    def summary(self, variants):
+        """Health of each variant, as reported by /metrics"""
+        with self._lock:
+            now = self._clock()
+            summary = {}
+            for variant in variants:
+                health = self._get(variant)
+                summary[variant] = {
+                    "available": self._usable(health, now),
+                    "probe": "up" if health.probe_up else "down",
+                    "breaker": health.breaker.state,
+                    "ejected_for": max(health.ejected_until - now, 0.0),
+                    "hedges": health.hedges,
+                    "hedges_won": health.hedges_won,
+                }
+            return summary
+
+    def start(self, check, interval=PROBE_INTERVAL):
+        """Run check() every interval seconds on a daemon thread (once per process)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._interval = interval
+            self._thread = threading.Thread(target=self._run, args=(check, interval), name='health-checks', daemon=True)
+        self._thread.start()
+
+    def _run(self, check, interval):
+        while True:
+            try:
+                check()
+            except Exception as e:
+                logger.error(f"Health check failed: {str(e)}")
+            time.sleep(interval)
@@ -0,0 +1,210 @@
+"""
+Local load test for the A/B load balancer.
+
+Starts two stub inference backends, then runs the balancer in each requested
+mode against them and drives it with concurrent /recommend/<user> requests.
+Reports requests/sec, latency percentiles, errors and how many TCP
+connections the balancer opened to the backends.
+
+    python load_test.py --requests 5000 --concurrency 64 --delay 0.01
+
+To compare with an older version of the balancer, export it and pass it as
+--legacy-app, e.g.
+
+    git show HEAD~1:loadbalancer/app.py > /tmp/app_legacy.py
+    python load_test.py --legacy-app /tmp/app_legacy.py
+"""
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import statistics
+import subprocess
+
+import aiohttp
+from aiohttp import web
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class StubBackend:
+    """Inference service stand-in answering /recommend/<user> after a fixed delay"""
+
+    def __init__(self, name, delay, body_size):
+        self.name = name
+        self.delay = delay
+        self.body = (f"{name}:" + "1," * body_size)[:body_size].encode()
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.connections = set()
+
+    async def recommend(self, request):
+        self.connections.add(request.transport.get_extra_info('peername'))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return web.Response(body=self.body, content_type='text/plain')
+
+    async def status(self, request):
+        return web.Response(text=f"{self.name} OK")
+
+    def start(self):
+        """Serve from a background thread with its own event loop"""
+        started = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            application = web.Application()
+            application.add_routes([
+                web.get('/recommend/{user}', self.recommend),
+                web.get('/status', self.status),
+            ])
+            runner = web.AppRunner(application, access_log=None)
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', self.port).start())
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, daemon=True).start()
+        started.wait()
+        return self
+
+
+def start_balancer(script, mode, port, backends):
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        PROXY_MODE=mode,
+        SERVICE_A_URL=backends[0].url,
+        SERVICE_B_URL=backends[1].url,
+    )
+    process = subprocess.Popen(
+        [sys.executable, script],
+        cwd=HERE,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{mode} balancer did not start on port {port}")
+
+
+async def enable_cache(url, ttl):
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{url}/config") as response:
+            config = await response.json()
+        config["coalescing"] = {"enabled": True}
+        config["cache"] = dict(config.get("cache") or {}, enabled=True, ttl=ttl)
+        async with session.post(f"{url}/config", json=config) as response:
+            response.raise_for_status()
+
+
+async def drive(url, num_requests, concurrency, num_users):
+    """Issue num_requests GETs with `concurrency` workers; return per-request latencies"""
+    latencies = []
+    errors = 0
+    next_request = iter(range(num_requests))
+
+    async def worker(session):
+        nonlocal errors
+        for i in next_request:
+            start = time.perf_counter()
+            try:
+                async with session.get(f"{url}/recommend/{i % num_users}") as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+def run_mode(label, script, mode, backends, args):
+    port = free_port()
+    process = start_balancer(script, mode, port, backends)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        if args.cache_ttl and label != "legacy":
+            asyncio.run(enable_cache(url, args.cache_ttl))
+        asyncio.run(drive(url, args.warmup, args.concurrency, args.users))
+        for backend in backends:
+            backend.connections.clear()
+
+        latencies, errors, elapsed = asyncio.run(drive(url, args.requests, args.concurrency, args.users))
+    finally:
+        process.terminate()
+        process.wait()
+
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "mode": label,
+        "rps": len(latencies) / elapsed,
+        "p50": percentiles[49] * 1000,
+        "p95": percentiles[94] * 1000,
+        "p99": percentiles[98] * 1000,
+        "max": max(latencies) * 1000,
+        "errors": errors,
+        "connections": sum(len(backend.connections) for backend in backends),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the A/B load balancer against local stub backends")
+    parser.add_argument("--requests", type=int, default=3000, help="Measured requests per mode")
+    parser.add_argument("--warmup", type=int, default=200, help="Unmeasured requests sent first")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent client connections")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct user ids requested")
+    parser.add_argument("--delay", type=float, default=0.005, help="Backend response delay in seconds")
+    parser.add_argument("--body-size", type=int, default=2048, help="Backend response body size in bytes")
+    parser.add_argument("--modes", default="threaded,async", help="Comma-separated balancer modes to run")
+    parser.add_argument("--cache-ttl", type=float, default=0, help="Enable request coalescing and the balancer's response cache with this TTL")
+    parser.add_argument("--legacy-app", help="Also run this (older) app.py, in threaded mode")
+    args = parser.parse_args()
+
+    backends = [
+        StubBackend("service-a", args.delay, args.body_size).start(),
+        StubBackend("service-b", args.delay, args.body_size).start(),
+    ]
+
+    runs = []
+    if args.legacy_app:
+        runs.append(("legacy", os.path.abspath(args.legacy_app), "threaded"))
+    for mode in args.modes.split(","):
+        script = "async_app.py" if mode == "async" else "app.py"
+        runs.append((mode, os.path.join(HERE, script), mode))
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"backend delay {args.delay * 1000:.1f} ms, body {args.body_size} B")
+    print(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}{'backend conns':>15}")
+    for label, script, mode in runs:
+        result = run_mode(label, script, mode, backends, args)
+        print(f"{result['mode']:<10}{result['rps']:>10.0f}{result['p50']:>10.1f}{result['p95']:>10.1f}"
+              f"{result['p99']:>10.1f}{result['max']:>10.1f}{result['errors']:>8}{result['connections']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Request metrics for the A/B load balancer.
+
+Latencies go into fixed-bucket histograms, one per (variant, status class),
+so recording a request is a bisect over a constant bucket table plus a few
+counter increments -- no list growth or re-slicing on the request path.
+Percentiles are estimated from the buckets when metrics are read, and the
+same histograms are exported in the Prometheus text format.
+"""
+import math
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency buckets: 0.5 ms to ~60 s, each bucket
+# sqrt(2) wider than the one before, plus an implicit +Inf bucket
+LATENCY_BUCKETS = tuple(round(0.0005 * 2 ** (i / 2), 6) for i in range(35))
+
+# Status class for requests that never got a response from the backend
+UNREACHABLE = "error"
+
+
+def status_class(status_code):
+    """Map an HTTP status code to its class, e.g. 404 -> "4xx\""""
+    return f"{status_code // 100}xx"
+
+
+class Histogram:
+    """Counts of observations per latency bucket, with their count and sum"""
+
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.sum += other.sum
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.merge(self)
+        return histogram
+
+    def quantile(self, q):
+        """
+        Estimate the q-quantile by interpolating linearly within its bucket.
+        Values in the +Inf bucket are reported as the largest finite bound.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.counts):
+            if n and cumulative + n >= rank:
+                if i == len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[-1]
+                lower = LATENCY_BUCKETS[i - 1] if i else 0.0
+                return lower + (LATENCY_BUCKETS[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return LATENCY_BUCKETS[-1]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Series:
+    """Histograms for one (variant, status class)"""
+
+    __slots__ = ("upstream", "total")
+
+    def __init__(self):
+        # Until the backend's response headers arrived
+        self.upstream = Histogram()
+        # Until the whole response was relayed to the client
+        self.total = Histogram()
+
+
+class RequestMetrics:
+    """
+    Thread-safe latency histograms per variant and status class.
+
+    A request's upstream time (until the backend answered) and total time
+    (until the client received the whole response) are recorded separately;
+    requests that could not reach a backend only have a total time and are
+    counted under the "error" status class.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _get_series(self, variant, status):
+        # Only allocates the first time a (variant, status class) pair is seen
+        key = (variant, status)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        return series
+
+    def record_upstream(self, variant, status_code, seconds):
+        with self._lock:
+            self._get_series(variant, status_class(status_code)).upstream.observe(seconds)
+
+    def record_total(self, variant, status_code, seconds):
+        with self._lock:
+            self._get_series(variant, status_class(status_code)).total.observe(seconds)
+
+    def record_error(self, variant, seconds):
+        with self._lock:
+            self._get_series(variant, UNREACHABLE).total.observe(seconds)
+
+    def quantile(self, variant, q, min_count=1):
+        """
+        Estimate the q-quantile of variant's upstream latency over its non-5xx
+        responses, or None if it has fewer than min_count of them
+        """
+        histogram = Histogram()
+        with self._lock:
+            for (name, status), series in self._series.items():
+                if name == variant and status not in (UNREACHABLE, "5xx"):
+                    histogram.merge(series.upstream)
+        return histogram.quantile(q) if histogram.count >= min_count else None
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """Return a consistent copy of all series, keyed by (variant, status class)"""
+        with self._lock:
+            return {key: (series.upstream.copy(), series.total.copy())
+                    for key, series in self._series.items()}
+
+    def summary(self):
+        """Per-variant request counts, error rate and latency percentiles"""
+        variants = {}
+        for (variant, status), (upstream, total) in sorted(self.snapshot().items()):
+            entry = variants.setdefault(variant, {
+                "requests": 0,
+                "responses": 0,
+                "errors": 0,
+                "status": {},
+                "upstream": Histogram(),
+                "total": Histogram(),
+            })
+            # Every request gets a total time once it finished; streaming ones
+            # that are still being relayed only have an upstream time so far
+            requests = max(upstream.count, total.count)
+            entry["requests"] += requests
+            entry["status"][status] = requests
+            if status == UNREACHABLE or status == "5xx":
+                entry["errors"] += requests
+            if status != UNREACHABLE:
+                entry["responses"] += requests
+            entry["upstream"].merge(upstream)
+            entry["total"].merge(total)
+
+        for entry in variants.values():
+            entry["error_rate"] = entry["errors"] / entry["requests"] if entry["requests"] else 0.0
+            entry["upstream"] = entry["upstream"].summary()
+            entry["total"] = entry["total"].summary()
+        return variants
+
+    def prometheus(self, prefix="ab_loadbalancer"):
+        """Render the metrics in the Prometheus text exposition format"""
+        series = sorted(self.snapshot().items())
+        lines = [
+            f"# HELP {prefix}_requests_total Proxied requests by variant and status class.",
+            f"# TYPE {prefix}_requests_total counter",
+        ]
+        for (variant, status), (upstream, total) in series:
+            lines.append(f'{prefix}_requests_total{{variant="{_escape(variant)}",status="{status}"}} '
+                         f'{max(upstream.count, total.count)}')
+
+        histograms = (
+            ("upstream_latency_seconds", "Time until the backend's response headers arrived.", 0),
+            ("request_duration_seconds", "Time until the whole response was relayed to the client.", 1),
+        )
+        for name, help_text, index in histograms:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for (variant, status), pair in series:
+                histogram = pair[index]
+                if not histogram.count:
+                    continue
+                labels = f'variant="{_escape(variant)}",status="{status}"'
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + (math.inf,), histogram.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f'{prefix}_{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{prefix}_{name}_sum{{{labels}}} {histogram.sum!r}")
+                lines.append(f"{prefix}_{name}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,218 @@
+"""
+Response sharing for the A/B load balancer.
+
+Identical GETs (same variant, path, query and Accept-Encoding) can be served
+from one upstream call in two ways:
+- single-flight: while a request is in flight, identical requests wait for
+  it and receive a copy of its response instead of calling the backend,
+- a small LRU cache keeps successful responses for a short TTL.
+
+Shared responses are buffered, so only bodies up to MAX_SHARED_BODY bytes are
+shared; larger ones are streamed to the request that fetched them and the
+other waiting requests call the backend themselves.
+"""
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+MAX_SHARED_BODY = int(os.environ.get('MAX_SHARED_BODY', 1024 * 1024))
+
+# Requests carrying these are private to one client and never shared
+PRIVATE_REQUEST_HEADERS = ('authorization', 'cookie')
+
+
+class SharedResponse:
+    """A fully buffered upstream response that can be replayed to several clients"""
+
+    __slots__ = ("variant", "status", "headers", "body")
+
+    def __init__(self, variant, status, headers, body):
+        self.variant = variant
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def cacheable(self):
+        """Only plain successful responses without per-client state are cached"""
+        if self.status != 200:
+            return False
+        for name, value in self.headers:
+            name = name.lower()
+            if name == 'set-cookie':
+                return False
+            if name == 'cache-control' and any(d in value.lower() for d in ('no-store', 'no-cache', 'private')):
+                return False
+        return True
+
+
+class UnsharedResponse:
+    """
+    An upstream response too large to buffer: the request that fetched it
+    streams it (already read prefix first), everyone else fetches their own
+    """
+
+    __slots__ = ("variant", "response", "prefix", "rest")
+
+    def __init__(self, variant, response, prefix, rest):
+        self.variant = variant
+        self.response = response
+        self.prefix = prefix
+        self.rest = rest
+
+
+def share_key(variant, path, headers):
+    """Key identifying identical requests, or None if the request must not be shared"""
+    if any(name in headers for name in PRIVATE_REQUEST_HEADERS):
+        return None
+    return variant, path, headers.get('accept-encoding', '')
+
+
+class ResponseCache:
+    """Thread-safe, size-bounded LRU cache of SharedResponses with a TTL"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.generation = 0
+        self.lookups = 0
+        self.hits = 0
+
+    def get(self, key):
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, response = entry
+            if self._clock() >= expires:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response, ttl, max_entries, generation):
+        """
+        Store response for ttl seconds, evicting the least recently used entries
+        beyond max_entries. Ignored if the cache was cleared since generation.
+        """
+        with self._lock:
+            if generation != self.generation or ttl <= 0 or max_entries <= 0:
+                return
+            self._entries[key] = (self._clock() + ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries; responses fetched before this call will not be stored"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def reset_stats(self):
+        with self._lock:
+            self.lookups = 0
+            self.hits = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            }
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its outcome"""
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Return (fn's result, whether this caller ran fn)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, True
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls = 0
+            self.shared = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.calls + self.shared
+            return {
+                "upstream_calls": self.calls,
+                "coalesced": self.shared,
+                "coalesce_rate": self.shared / requests if requests else 0.0,
+            }
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for coroutines. The shared call runs as its own task, so it
+    completes for the other waiters even if the client that started it leaves.
+    """
+
+    async def do(self, key, fn, on_abandoned=None):
+        """
+        Return (fn's result, whether this caller ran fn). If the caller that
+        started the call is cancelled while waiting, on_abandoned(result) is
+        called once the result is ready, to release what was meant for it.
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.calls += 1
+        else:
+            self.shared += 1
+        try:
+            return await asyncio.shield(task), leader
+        except asyncio.CancelledError:
+            if leader and on_abandoned is not None:
+                task.add_done_callback(
+                    lambda done: done.cancelled() or done.exception() is not None or on_abandoned(done.result())
+                )
+            raise
@@ -0,0 +1,597 @@
+import copy
+import time
+import asyncio
+import logging
+import threading
+import unittest
+import unittest.mock
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from aiohttp.test_utils import TestClient, TestServer
+from yarl import URL
+
+import app as lb
+import async_app
+from health import CircuitBreaker, HealthTracker
+from request_metrics import LATENCY_BUCKETS, Histogram, RequestMetrics
+from response_cache import AsyncSingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients (e.g. the losing side of a hedge) may hang up mid-response
+        pass
+
+
+class StubBackend:
+    """Local inference service whose delay and status codes can be changed mid-test"""
+
+    def __init__(self, name):
+        self.name = name
+        self.delay = 0.0
+        self.status = 200
+        self.status_page = 200
+        self.requests = 0
+        self.connections = 0
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                backend.connections += 1
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self._reply(backend.status_page, f"{backend.name} status")
+                    return
+                backend.requests += 1
+                time.sleep(backend.delay)
+                self._reply(backend.status, f"{backend.name}:{self.path}")
+
+            def _reply(self, status, text):
+                body = text.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = QuietHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class LoadBalancerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.backend_a = StubBackend("a")
+        self.backend_b = StubBackend("b")
+        self.clock = FakeClock()
+
+        lb.HEALTH_CHECKS = False
+        lb.config = copy.deepcopy(lb.DEFAULT_CONFIG)
+        lb.config["variant_a"]["service_url"] = self.backend_a.url
+        lb.config["variant_b"]["service_url"] = self.backend_b.url
+        lb.config["monitoring"]["log_level"] = "WARNING"
+        lb.update_config(lb.config)
+        lb.reset_all_metrics()
+        lb.health = HealthTracker(breaker_failures=3, breaker_reset=10, ejection_min_requests=5, clock=self.clock)
+        self.client = lb.app.test_client()
+
+    def tearDown(self):
+        self.backend_a.close()
+        self.backend_b.close()
+
+    def user_routed_to(self, variant):
+        """A user id whose first choice is variant"""
+        return next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == variant)
+
+    def test_users_stick_to_weighted_variants(self):
+        users = [str(i) for i in range(4000)]
+        first = {user: lb.select_variant(user) for user in users}
+        self.assertEqual(first, {user: lb.select_variant(user) for user in users})
+        self.assertAlmostEqual(Counter(first.values())["variant_a"] / len(users), 0.5, delta=0.05)
+
+        lb.config["variant_a"]["weight"] = 80
+        lb.config["variant_b"]["weight"] = 20
+        second = {user: lb.select_variant(user) for user in users}
+        moved = [user for user in users if first[user] != second[user]]
+        # Only the users needed for the new split move, and only towards variant_a
+        self.assertAlmostEqual(len(moved) / len(users), 0.3, delta=0.05)
+        self.assertTrue(all(second[user] == "variant_a" for user in moved))
+
+    def test_added_variant_only_takes_users_from_others(self):
+        users = [str(i) for i in range(4000)]
+        before = {user: lb.select_variant(user) for user in users}
+
+        config = copy.deepcopy(lb.config)
+        config["variant_c"] = {"service_url": self.backend_b.url, "weight": 100}
+        self.assertEqual(self.client.post("/config", json=config).status_code, 200)
+        after = {user: lb.select_variant(user) for user in users}
+
+        shares = Counter(after.values())
+        self.assertAlmostEqual(shares["variant_c"] / len(users), 0.5, delta=0.05)
+        # Users either keep their variant or move to the new one
+        self.assertTrue(all(after[user] in (before[user], "variant_c") for user in users))
+
+        user = next(user for user in users if after[user] == "variant_c")
+        self.assertEqual(self.client.get(f"/recommend/{user}").headers["X-Served-By"], "variant_c")
+
+    def test_zero_weight_variants_get_no_users(self):
+        config = copy.deepcopy(lb.config)
+        config["variant_b"]["weight"] = 0
+        self.assertEqual(self.client.post("/config", json=config).status_code, 200)
+        self.assertEqual(lb.rank_variants("42"), ["variant_a"])
+        self.assertEqual({lb.select_variant(str(i)) for i in range(200)}, {"variant_a"})
+
+        config["variant_a"]["weight"] = 0
+        self.assertEqual(self.client.post("/config", json=config).status_code, 400)
+        config["variant_a"]["weight"] = -1
+        self.assertEqual(self.client.post("/config", json=config).status_code, 400)
+
+    def test_user_id_is_taken_from_recommend_paths(self):
+        self.assertEqual(lb.user_from_path("/recommend/42"), "42")
+        self.assertEqual(lb.user_from_path("/recommend/42/extra"), "42")
+        self.assertIsNone(lb.user_from_path("/status"))
+
+    def test_proxy_tags_serving_variant(self):
+        user = self.user_routed_to("variant_b")
+        response = self.client.get(f"/recommend/{user}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_data(as_text=True), f"b:/recommend/{user}")
+        self.assertEqual(response.headers["X-Served-By"], "variant_b")
+        # By default responses are streamed, not buffered for sharing
+        self.assertNotIn("X-Cache", response.headers)
+
+    def test_breaker_opens_on_failures_and_recovers(self):
+        user = self.user_routed_to("variant_a")
+        self.backend_a.status = 500
+
+        for _ in range(3):
+            self.assertEqual(self.client.get(f"/recommend/{user}").status_code, 500)
+        # Breaker is open: the user falls back to variant_b without touching variant_a
+        response = self.client.get(f"/recommend/{user}")
+        self.assertEqual(response.headers["X-Served-By"], "variant_b")
+        self.assertEqual(self.backend_a.requests, 3)
+        self.assertEqual(lb.health.summary(["variant_a"])["variant_a"]["breaker"], "open")
+
+        # After the reset timeout one trial request goes through and closes the breaker
+        self.backend_a.status = 200
+        self.clock.now += 10
+        response = self.client.get(f"/recommend/{user}")
+        self.assertEqual(response.headers["X-Served-By"], "variant_a")
+        self.assertEqual(lb.health.summary(["variant_a"])["variant_a"]["breaker"], "closed")
+
+    def test_failed_probes_take_variant_out_of_rotation(self):
+        user = self.user_routed_to("variant_a")
+        self.backend_a.status_page = 503
+
+        lb.probe_variants()
+        self.assertEqual(self.client.get(f"/recommend/{user}").headers["X-Served-By"], "variant_a")
+        lb.probe_variants()
+        self.assertEqual(self.client.get(f"/recommend/{user}").headers["X-Served-By"], "variant_b")
+
+        status = self.client.get("/status")
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(status.get_data(as_text=True), "DEGRADED - Some services unavailable")
+
+        self.backend_a.status_page = 200
+        lb.probe_variants()
+        self.assertEqual(self.client.get(f"/recommend/{user}").headers["X-Served-By"], "variant_a")
+
+    def test_status_probes_live_without_health_checks(self):
+        # HEALTH_CHECKS is off in these tests, so no background prober is running
+        response = self.client.get("/status")
+        self.assertEqual((response.status_code, response.get_data(as_text=True)), (200, "OK"))
+
+        self.backend_a.status_page = self.backend_b.status_page = 503
+        response = self.client.get("/status")
+        self.assertEqual((response.status_code, response.get_data(as_text=True)), (500, "CRITICAL - All services down"))
+
+    def test_hedging_bounds_latency_when_backend_stalls(self):
+        user = self.user_routed_to("variant_a")
+        self.backend_a.delay = 2.0
+        lb.config["hedging"].update(enabled=True, min_delay=0.01, max_delay=0.05)
+
+        start = time.perf_counter()
+        response = self.client.get(f"/recommend/{user}")
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["X-Served-By"], "variant_b")
+        self.assertLess(elapsed, 1.0)
+        summary = lb.health.summary(["variant_b"])["variant_b"]
+        self.assertEqual((summary["hedges"], summary["hedges_won"]), (1, 1))
+
+    def test_hedging_is_not_starved_by_stalled_primaries(self):
+        # More concurrent requests than POOL_SIZE, all stuck on variant_a
+        users = [str(i) for i in range(200) if lb.rank_variants(str(i))[0] == "variant_a"][:12]
+        self.backend_a.delay = 2.0
+        lb.config["hedging"].update(enabled=True, min_delay=0.01, max_delay=0.05)
+
+        def get(user):
+            start = time.perf_counter()
+            response = lb.app.test_client().get(f"/recommend/{user}")
+            return response.headers["X-Served-By"], time.perf_counter() - start
+
+        # Connections beyond POOL_SIZE are discarded with a warning; that is expected here
+        quiet_pool = unittest.mock.patch.object(logging.getLogger("urllib3.connectionpool"), "disabled", True)
+        with unittest.mock.patch.object(lb, "POOL_SIZE", 4), quiet_pool, ThreadPoolExecutor(max_workers=len(users)) as pool:
+            results = list(pool.map(get, users))
+
+        self.assertEqual({variant for variant, _ in results}, {"variant_b"})
+        self.assertLess(max(elapsed for _, elapsed in results), 1.0)
+
+    def test_fast_primary_is_not_hedged(self):
+        user = self.user_routed_to("variant_a")
+        lb.config["hedging"].update(enabled=True, max_delay=0.5)
+
+        response = self.client.get(f"/recommend/{user}")
+        self.assertEqual(response.headers["X-Served-By"], "variant_a")
+        self.assertEqual(self.backend_b.requests, 0)
+
+
+    def test_identical_concurrent_gets_share_one_upstream_call(self):
+        lb.config["coalescing"]["enabled"] = True
+        self.backend_a.delay = self.backend_b.delay = 0.3
+
+        def get(_):
+            response = lb.app.test_client().get("/recommend/42")
+            return response.get_data(as_text=True), response.headers["X-Cache"]
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            results = list(pool.map(get, range(5)))
+
+        self.assertEqual(len({body for body, _ in results}), 1)
+        self.assertEqual(sorted(cache for _, cache in results), ["COALESCED"] * 4 + ["MISS"])
+        self.assertEqual(self.backend_a.requests + self.backend_b.requests, 1)
+        summary = self.client.get("/metrics").get_json()
+        self.assertEqual((summary["cache"]["upstream_calls"], summary["cache"]["coalesced"]), (1, 4))
+        # Coalesced requests still count as client traffic, with their own total time
+        self.assertEqual(summary["total_requests"], 5)
+        variant = results[0][0].split(":")[0]
+        self.assertEqual(summary["variants"][f"variant_{variant}"]["total"]["count"], 5)
+        self.assertEqual(summary["variants"][f"variant_{variant}"]["upstream"]["count"], 1)
+
+    def test_private_requests_are_not_shared(self):
+        lb.config["coalescing"]["enabled"] = True
+        self.client.get("/recommend/42", headers={"Authorization": "Bearer x"})
+        self.assertEqual(self.client.get("/metrics").get_json()["cache"]["upstream_calls"], 0)
+
+    def test_cache_serves_repeat_gets_until_config_changes(self):
+        lb.config["cache"].update(enabled=True, ttl=60)
+
+        self.assertEqual(self.client.get("/recommend/42").headers["X-Cache"], "MISS")
+        response = self.client.get("/recommend/42")
+        self.assertEqual(response.headers["X-Cache"], "HIT")
+        self.assertEqual(response.get_data(as_text=True).split(":")[1], "/recommend/42")
+        self.assertEqual(self.backend_a.requests + self.backend_b.requests, 1)
+
+        self.client.post("/config", json=lb.config)
+        self.assertEqual(self.client.get("/recommend/42").headers["X-Cache"], "MISS")
+        self.assertEqual(self.backend_a.requests + self.backend_b.requests, 2)
+        summary = self.client.get("/metrics").get_json()
+        self.assertEqual((summary["cache"]["lookups"], summary["cache"]["hits"]), (3, 1))
+        self.assertEqual(summary["total_requests"], 3)
+
+    def test_error_responses_are_not_cached(self):
+        lb.config["cache"].update(enabled=True, ttl=60)
+        self.backend_a.status = self.backend_b.status = 404
+
+        self.client.get("/recommend/42")
+        self.assertEqual(self.client.get("/recommend/42").headers["X-Cache"], "MISS")
+
+    def test_prometheus_endpoint(self):
+        user = self.user_routed_to("variant_a")
+        self.client.get(f"/recommend/{user}")
+
+        response = self.client.get("/metrics/prometheus")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], lb.PROMETHEUS_CONTENT_TYPE)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertIn('ab_loadbalancer_requests_total{variant="variant_a",status="2xx"} 1', lines)
+        self.assertIn('ab_loadbalancer_request_duration_seconds_count{variant="variant_a",status="2xx"} 1', lines)
+
+        lb.config["monitoring"]["enabled"] = False
+        self.assertEqual(self.client.get("/metrics/prometheus").status_code, 403)
+
+
+class RequestMetricsTestCase(unittest.TestCase):
+    def test_empty_histogram(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.quantile(0.5))
+        self.assertEqual(histogram.summary(), {"count": 0, "mean": None, "p50": None, "p95": None, "p99": None})
+
+    def test_quantile_interpolates_within_bucket(self):
+        histogram = Histogram()
+        for _ in range(4):
+            histogram.observe(0.0001)
+        # All four fall in [0, 0.5 ms]: the median is halfway through it
+        self.assertAlmostEqual(histogram.quantile(0.5), LATENCY_BUCKETS[0] / 2)
+
+        histogram = Histogram()
+        histogram.observe(0.0002)
+        histogram.observe(0.0006)
+        self.assertAlmostEqual(histogram.quantile(0.5), LATENCY_BUCKETS[0])
+        self.assertAlmostEqual(histogram.quantile(1.0), LATENCY_BUCKETS[1])
+        self.assertAlmostEqual(histogram.quantile(0.75), (LATENCY_BUCKETS[0] + LATENCY_BUCKETS[1]) / 2)
+
+    def test_quantile_in_inf_bucket_is_largest_bound(self):
+        histogram = Histogram()
+        histogram.observe(LATENCY_BUCKETS[-1] * 10)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.quantile(0.99), LATENCY_BUCKETS[-1])
+
+    def test_summary_counts_errors_per_variant(self):
+        metrics = RequestMetrics()
+        for _ in range(2):
+            metrics.record_upstream("variant_a", 200, 0.01)
+            metrics.record_total("variant_a", 200, 0.02)
+        metrics.record_upstream("variant_a", 503, 0.01)
+        metrics.record_total("variant_a", 503, 0.01)
+        metrics.record_error("variant_a", 0.5)
+        # Still streaming: only the upstream time is known yet
+        metrics.record_upstream("variant_b", 404, 0.01)
+
+        summary = metrics.summary()
+        variant_a = summary["variant_a"]
+        self.assertEqual((variant_a["requests"], variant_a["responses"], variant_a["errors"]), (4, 3, 2))
+        self.assertEqual(variant_a["status"], {"2xx": 2, "5xx": 1, "error": 1})
+        self.assertEqual(variant_a["error_rate"], 0.5)
+        self.assertEqual(variant_a["upstream"]["count"], 3)
+        self.assertEqual(variant_a["total"]["count"], 4)
+        self.assertAlmostEqual(variant_a["total"]["mean"], 0.55 / 4)
+
+        variant_b = summary["variant_b"]
+        self.assertEqual((variant_b["requests"], variant_b["responses"], variant_b["errors"]), (1, 1, 0))
+        self.assertEqual(variant_b["total"]["count"], 0)
+
+    def test_prometheus_exposition(self):
+        metrics = RequestMetrics()
+        metrics.record_upstream('a"b\\c\n', 200, 0.0002)
+        metrics.record_upstream('a"b\\c\n', 200, 0.0006)
+        metrics.record_error("variant_b", 0.1)
+
+        lines = metrics.prometheus().splitlines()
+        labels = 'variant="a\\"b\\\\c\\n",status="2xx"'
+        self.assertIn(f"ab_loadbalancer_requests_total{{{labels}}} 2", lines)
+        self.assertIn('ab_loadbalancer_requests_total{variant="variant_b",status="error"} 1', lines)
+
+        buckets = [line for line in lines if line.startswith(f"ab_loadbalancer_upstream_latency_seconds_bucket{{{labels}")]
+        self.assertEqual(len(buckets), len(LATENCY_BUCKETS) + 1)
+        # Bucket counts are cumulative and end with +Inf
+        self.assertEqual(buckets[0], f'ab_loadbalancer_upstream_latency_seconds_bucket{{{labels},le="0.0005"}} 1')
+        self.assertEqual(buckets[1], f'ab_loadbalancer_upstream_latency_seconds_bucket{{{labels},le="{LATENCY_BUCKETS[1]!r}"}} 2')
+        self.assertEqual(buckets[-1], f'ab_loadbalancer_upstream_latency_seconds_bucket{{{labels},le="+Inf"}} 2')
+        self.assertIn(f"ab_loadbalancer_upstream_latency_seconds_sum{{{labels}}} {0.0002 + 0.0006!r}", lines)
+        self.assertIn(f"ab_loadbalancer_upstream_latency_seconds_count{{{labels}}} 2", lines)
+
+        # Series without observations of a kind are left out of that histogram
+        self.assertFalse(any(line.startswith('ab_loadbalancer_upstream_latency_seconds_count{variant="variant_b"')
+                             for line in lines))
+        self.assertIn('ab_loadbalancer_request_duration_seconds_count{variant="variant_b",status="error"} 1', lines)
+        self.assertIn("# TYPE ab_loadbalancer_request_duration_seconds histogram", lines)
+
+
+class HealthTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.health = HealthTracker(ejection_min_requests=5, ejection_time=30, clock=self.clock)
+
+    def test_probe_results_are_served_only_while_fresh(self):
+        self.health.record_probe("variant_a", {"status": "up"})
+        # Without a running probe thread results go stale immediately
+        self.assertIsNone(self.health.probe_results(["variant_a"]))
+
+        self.health.start(lambda: None, interval=5)
+        self.assertEqual(self.health.probe_results(["variant_a"]), {"variant_a": {"status": "up"}})
+        self.assertIsNone(self.health.probe_results(["variant_a", "variant_b"]))
+
+        self.clock.now += 11
+        self.assertIsNone(self.health.probe_results(["variant_a"]))
+
+    def test_half_open_breaker_allows_one_trial(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=5, clock=self.clock)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        self.clock.now += 5
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_slow_variant_is_ejected_with_growing_duration(self):
+        variants = ["variant_a", "variant_b", "variant_c"]
+        for _ in range(2):
+            for _ in range(10):
+                self.health.record("variant_a", ok=True, latency=0.5)
+                self.health.record("variant_b", ok=True, latency=0.02)
+                self.health.record("variant_c", ok=True, latency=0.03)
+            self.health.sweep(variants)
+            self.assertFalse(self.health.available("variant_a"))
+            self.assertTrue(self.health.available("variant_b"))
+            self.clock.now += self.health.summary(variants)["variant_a"]["ejected_for"]
+
+        self.assertTrue(self.health.available("variant_a"))
+        self.assertEqual(self.health._variants["variant_a"].ejections, 2)
+
+    def test_last_available_variant_is_never_ejected(self):
+        self.health = HealthTracker(breaker_failures=100, ejection_min_requests=5, clock=self.clock)
+        for _ in range(10):
+            self.health.record("variant_a", ok=False, latency=0.01)
+            self.health.record("variant_b", ok=False, latency=0.01)
+        self.health.sweep(["variant_a", "variant_b"])
+
+        available = [self.health.available(v) for v in ("variant_a", "variant_b")]
+        self.assertEqual(available.count(True), 1)
+
+
+class AsyncProxyTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.backend_a = StubBackend("a")
+        self.backend_b = StubBackend("b")
+        lb.HEALTH_CHECKS = False
+        lb.config = copy.deepcopy(lb.DEFAULT_CONFIG)
+        lb.config["variant_a"]["service_url"] = self.backend_a.url
+        lb.config["variant_b"]["service_url"] = self.backend_b.url
+        lb.config["monitoring"]["log_level"] = "WARNING"
+        lb.update_config(lb.config)
+        lb.reset_all_metrics(async_app.coalescer)
+        lb.health = HealthTracker(breaker_failures=3)
+        self.client = TestClient(TestServer(async_app.create_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        self.backend_a.close()
+        self.backend_b.close()
+
+    async def test_proxies_raw_path_and_status(self):
+        user = next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == "variant_a")
+        self.backend_a.status = 404
+
+        response = await self.client.get(URL(f"/recommend/{user}?next=a%2Fb&x=1", encoded=True))
+        self.assertEqual(response.status, 404)
+        # The path and query string reach the backend exactly as they were sent
+        self.assertEqual(await response.text(), f"a:/recommend/{user}?next=a%2Fb&x=1")
+        self.assertEqual(response.headers["X-Served-By"], "variant_a")
+        self.assertEqual(response.headers["Content-Type"], "text/plain")
+
+    async def test_requests_reuse_keep_alive_connections(self):
+        user = next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == "variant_a")
+        for _ in range(5):
+            response = await self.client.get(f"/recommend/{user}")
+            self.assertEqual(response.status, 200)
+            await response.read()
+
+        self.assertEqual(self.backend_a.requests, 5)
+        self.assertEqual(self.backend_a.connections, 1)
+
+    async def test_unreachable_backend_returns_503(self):
+        self.backend_a.close()
+        self.backend_b.close()
+
+        response = await self.client.get("/recommend/42")
+        self.assertEqual(response.status, 503)
+        self.assertEqual((await response.json())["error"], "Failed to reach service")
+
+    async def test_hedging_bounds_latency_when_backend_stalls(self):
+        user = next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == "variant_a")
+        self.backend_a.delay = 2.0
+        lb.config["hedging"].update(enabled=True, min_delay=0.01, max_delay=0.05)
+
+        start = time.perf_counter()
+        response = await self.client.get(f"/recommend/{user}")
+        body = await response.text()
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(body, f"b:/recommend/{user}")
+        self.assertEqual(response.headers["X-Served-By"], "variant_b")
+        self.assertLess(elapsed, 1.0)
+
+    async def test_breaker_fails_over_to_other_variant(self):
+        user = next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == "variant_a")
+        self.backend_a.status = 503
+
+        for _ in range(3):
+            response = await self.client.get(f"/recommend/{user}")
+            self.assertEqual(response.status, 503)
+        response = await self.client.get(f"/recommend/{user}")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers["X-Served-By"], "variant_b")
+
+        metrics = await (await self.client.get("/metrics")).json()
+        self.assertEqual(metrics["health"]["variant_a"]["breaker"], "open")
+        self.assertEqual(metrics["variants"]["variant_a"]["status"]["5xx"], 3)
+
+    async def test_identical_concurrent_gets_share_one_upstream_call(self):
+        lb.config["coalescing"]["enabled"] = True
+        self.backend_a.delay = self.backend_b.delay = 0.3
+
+        async def get():
+            response = await self.client.get("/recommend/42")
+            return await response.text(), response.headers["X-Cache"]
+
+        results = await asyncio.gather(*(get() for _ in range(5)))
+
+        self.assertEqual(len({body for body, _ in results}), 1)
+        self.assertEqual(sorted(cache for _, cache in results), ["COALESCED"] * 4 + ["MISS"])
+        self.assertEqual(self.backend_a.requests + self.backend_b.requests, 1)
+        summary = await (await self.client.get("/metrics")).json()
+        self.assertEqual(summary["total_requests"], 5)
+
+    async def test_large_responses_are_streamed_not_shared(self):
+        user = next(str(i) for i in range(1000) if lb.rank_variants(str(i))[0] == "variant_a")
+        lb.config["coalescing"]["enabled"] = True
+        self.backend_a.delay = 0.3
+        with unittest.mock.patch("async_app.MAX_SHARED_BODY", 4):
+            responses = await asyncio.gather(*(self.client.get(f"/recommend/{user}") for _ in range(3)))
+            bodies = [await response.text() for response in responses]
+
+        self.assertEqual(bodies, [f"a:/recommend/{user}"] * 3)
+        self.assertTrue(all("X-Cache" not in response.headers for response in responses))
+        self.assertEqual(self.backend_a.requests, 3)
+
+    async def test_coalesced_requests_share_one_concurrency_slot(self):
+        lb.config["coalescing"]["enabled"] = True
+        self.backend_a.delay = self.backend_b.delay = 0.3
+        limit = self.client.app[async_app.pools_key].limit = asyncio.Semaphore(1)
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(self.client.get("/recommend/42") for _ in range(5)))
+        elapsed = time.perf_counter() - start
+
+        # Followers wait for the leader's call without taking slots of their own
+        self.assertEqual(sorted(response.headers["X-Cache"] for response in responses), ["COALESCED"] * 4 + ["MISS"])
+        self.assertEqual(self.backend_a.requests + self.backend_b.requests, 1)
+        self.assertLess(elapsed, 1.0)
+        self.assertFalse(limit.locked())
+
+    async def test_single_flight_hands_cancelled_leaders_result_to_on_abandoned(self):
+        single_flight = AsyncSingleFlight()
+        answer = asyncio.Event()
+        abandoned = []
+
+        async def call():
+            await answer.wait()
+            return "response"
+
+        leader = asyncio.ensure_future(single_flight.do("key", call, on_abandoned=abandoned.append))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(single_flight.do("key", call, on_abandoned=abandoned.append))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+        answer.set()
+        self.assertEqual(await follower, ("response", False))
+        await asyncio.sleep(0)
+        self.assertEqual(abandoned, ["response"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Script to compile the NCF serving artifacts into a single versioned bundle.
+
+The prediction service currently starts by parsing recommendation_data.csv with
+pandas, unpickling the id mapping dicts and loading ncf_model.pt on its own.
+This script does that work once, offline, and writes everything the service
+needs at request time into one memory-mappable file:
+
+- the model weights as raw float32 arrays
+- the user/item id mappings as sorted id arrays (for np.searchsorted lookups)
+  plus the matching model indices
+- the seen-items index in CSR form (seen_indptr / seen_items, by user index)
+  and the catalog of item indices present in the interaction data
+- the cold-start popularity ranking (mean rating, with rating counts)
+
+Layout: an 8 byte magic, a little-endian uint64 header length, a JSON header
+describing every array (dtype, shape, offset) and a SHA-256 checksum of the
+payload, then the payload with each array aligned to 64 bytes.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import statistics
+import struct
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+BUNDLE_MAGIC = b"NCFBNDL\x01"
+BUNDLE_FORMAT = 1
+ALIGNMENT = 64
+
+DEFAULT_BASE_PATH = Path(__file__).parent.parent / "cool_counters" / "counter"
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _id_array(ids):
+    """Convert a sequence of ids to an int64 array, or fixed-width bytes for string ids."""
+    ids = np.asarray(list(ids))
+    if ids.dtype.kind in "iub":
+        return ids.astype(np.int64)
+    return np.char.encode(ids.astype(str), "utf-8")
+
+
+def _sorted_mapping(id_to_idx):
+    """Turn an {id: idx} dict into (sorted ids, idx aligned with them)."""
+    ids = _id_array(id_to_idx.keys())
+    idx = np.fromiter(id_to_idx.values(), dtype=np.int64, count=len(id_to_idx))
+    order = np.argsort(ids, kind="stable")
+    return ids[order], idx[order]
+
+
+def lookup(sorted_ids, idx, keys, missing=-1):
+    """
+    Vectorized id -> model index lookup against a sorted id array.
+
+    Args:
+        sorted_ids (np.ndarray): Sorted ids from the bundle (e.g. "user_ids")
+        idx (np.ndarray): Model indices aligned with sorted_ids (e.g. "user_idx")
+        keys: A single id or a sequence of ids to look up
+        missing (int): Value returned for ids not in the mapping
+    Returns:
+        np.ndarray: Model indices, one per key
+    """
+    keys = np.atleast_1d(np.asarray(keys))
+    if sorted_ids.dtype.kind == "S" and keys.dtype.kind != "S":
+        keys = np.char.encode(keys.astype(str), "utf-8")
+    elif sorted_ids.dtype.kind != "S":
+        keys = keys.astype(sorted_ids.dtype)
+
+    pos = np.searchsorted(sorted_ids, keys)
+    pos_clipped = np.minimum(pos, len(sorted_ids) - 1)
+    found = (pos < len(sorted_ids)) & (sorted_ids[pos_clipped] == keys)
+    return np.where(found, idx[pos_clipped], missing)
+
+
+def build_seen_index(data, user_ids, user_idx, item_ids, item_idx, num_users):
+    """
+    Build the CSR seen-items index and the catalog from the interaction data.
+
+    Returns:
+        tuple: (seen_indptr, seen_items, catalog), all int64 arrays over model indices
+    """
+    users = lookup(user_ids, user_idx, data["user_id"].to_numpy())
+    items = lookup(item_ids, item_idx, data["movie_id"].to_numpy())
+
+    # Interactions with ids the model does not know about cannot be excluded
+    known = (users >= 0) & (items >= 0)
+    pairs = np.unique(np.stack([users[known], items[known]], axis=1), axis=0)
+
+    counts = np.bincount(pairs[:, 0], minlength=num_users) if len(pairs) else np.zeros(num_users, dtype=np.int64)
+    seen_indptr = np.zeros(num_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=seen_indptr[1:])
+    seen_items = pairs[:, 1].astype(np.int64)
+
+    catalog = np.unique(items[items >= 0]).astype(np.int64)
+    return seen_indptr, seen_items, catalog
+
+
+def build_popularity(data):
+    """Rank movies by mean rating, the same ordering get_top_n_movies produces."""
+    stats = data.groupby("movie_id")["rating"].agg(["mean", "count"])
+    stats = stats.sort_values(by="mean", ascending=False, kind="stable")
+    return (
+        _id_array(stats.index),
+        stats["mean"].to_numpy(dtype=np.float64),
+        stats["count"].to_numpy(dtype=np.int64),
+    )
+
+
+def collect_arrays(state_dict, mappings, data):
+    """Gather every array that goes into the bundle, keyed by name."""
+    arrays = {}
+    for name, tensor in state_dict.items():
+        arrays[f"weights/{name}"] = tensor.detach().cpu().numpy().astype(np.float32)
+
+    user_ids, user_idx = _sorted_mapping(mappings["user_to_idx"])
+    item_ids, item_idx = _sorted_mapping(mappings["item_to_idx"])
+    num_users = int(user_idx.max()) + 1 if len(user_idx) else 0
+    num_items = int(item_idx.max()) + 1 if len(item_idx) else 0
+
+    idx_to_item = np.zeros(num_items, dtype=item_ids.dtype)
+    idx_to_item[item_idx] = item_ids
+
+    arrays.update({
+        "user_ids": user_ids,
+        "user_idx": user_idx,
+        "item_ids": item_ids,
+        "item_idx": item_idx,
+        "idx_to_item": idx_to_item,
+    })
+
+    seen_indptr, seen_items, catalog = build_seen_index(
+        data, user_ids, user_idx, item_ids, item_idx, num_users
+    )
+    arrays.update({
+        "seen_indptr": seen_indptr,
+        "seen_items": seen_items,
+        "catalog": catalog,
+    })
+
+    popularity_ids, popularity_scores, popularity_counts = build_popularity(data)
+    arrays.update({
+        "popularity_ids": popularity_ids,
+        "popularity_scores": popularity_scores,
+        "popularity_counts": popularity_counts,
+    })
+    return arrays
+
+
+def write_bundle(output_path, arrays, metadata):
+    """Write arrays and metadata to output_path in the bundle layout."""
+    table = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = _align(offset)
+        table[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += array.nbytes
+    payload_size = offset
+
+    payload = bytearray(payload_size)
+    for name, array in arrays.items():
+        start = table[name]["offset"]
+        payload[start:start + array.nbytes] = array.tobytes()
+
+    header = dict(metadata)
+    header.update({
+        "format": BUNDLE_FORMAT,
+        "arrays": table,
+        "payload_size": payload_size,
+        "sha256": hashlib.sha256(payload).hexdigest(),
+    })
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    # Pad the header so the payload starts on an aligned offset
+    prefix_size = len(BUNDLE_MAGIC) + 8
+    header_bytes += b" " * (_align(prefix_size + len(header_bytes)) - prefix_size - len(header_bytes))
+
+    # Write next to the target and rename, so a reader never maps a partial file
+    tmp_path = Path(f"{output_path}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(BUNDLE_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(tmp_path, output_path)
+    return header
+
+
+def load_bundle(bundle_path, verify=False):
+    """
+    Memory-map a serving bundle.
+
+    Args:
+        bundle_path: Path to the bundle file
+        verify (bool): Check the payload against the header checksum (reads the whole file)
+    Returns:
+        tuple: (header dict, dict of read-only numpy arrays backed by the mapping)
+    """
+    with open(bundle_path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(BUNDLE_MAGIC)] != BUNDLE_MAGIC:
+        raise ValueError(f"{bundle_path} is not a serving bundle")
+    (header_len,) = struct.unpack_from("<Q", buffer, len(BUNDLE_MAGIC))
+    payload_start = len(BUNDLE_MAGIC) + 8 + header_len
+    header = json.loads(buffer[len(BUNDLE_MAGIC) + 8:payload_start])
+
+    if header.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported bundle format: {header.get('format')}")
+    if len(buffer) - payload_start != header["payload_size"]:
+        raise ValueError(f"{bundle_path} is truncated")
+    if verify:
+        digest = hashlib.sha256(memoryview(buffer)[payload_start:]).hexdigest()
+        if digest != header["sha256"]:
+            raise ValueError(f"Checksum mismatch for {bundle_path}")
+
+    arrays = {}
+    for name, entry in header["arrays"].items():
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=payload_start + entry["offset"]
+        ).reshape(entry["shape"])
+    return header, arrays
+
+
+def state_dict_from_bundle(arrays):
+    """Build a torch state_dict that shares memory with the mapped weight arrays."""
+    prefix = "weights/"
+    # The mapping is read-only; torch warns about that, but inference never writes to the weights
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)
+        return {
+            name[len(prefix):]: torch.from_numpy(array)
+            for name, array in arrays.items()
+            if name.startswith(prefix)
+        }
+
+
+def build_bundle(models_dir, data_path, output_path):
+    """Compile ncf_model.pt, ncf_model_mappings.pkl and the interaction data into one bundle."""
+    models_dir = Path(models_dir)
+    t0 = time.time()
+
+    with open(models_dir / "ncf_model_mappings.pkl", "rb") as f:
+        mappings = pickle.load(f)
+    state_dict = torch.load(
+        models_dir / "ncf_model.pt", map_location=torch.device("cpu"), weights_only=True
+    )
+    data = pd.read_csv(data_path)
+
+    arrays = collect_arrays(state_dict, mappings, data)
+    metadata = {
+        "version": str(mappings.get("version", "")),
+        "timestamp": mappings.get("timestamp"),
+        "built_at": time.time(),
+    }
+    header = write_bundle(output_path, arrays, metadata)
+
+    size_mb = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"Wrote bundle {output_path} ({size_mb:.2f} MB, {len(header['arrays'])} arrays) "
+          f"in {time.time() - t0:.2f} s")
+    print(f"  version: {header['version']}  sha256: {header['sha256']}")
+    return header
+
+
+def benchmark(models_dir, data_path, bundle_path, repeats=5):
+    """Compare the current CSV + pickle + torch.load path with mapping the bundle."""
+    models_dir = Path(models_dir)
+
+    def current_load():
+        data = pd.read_csv(data_path)
+        data["user_id"].unique()
+        data["movie_id"].unique()
+        with open(models_dir / "ncf_model_mappings.pkl", "rb") as f:
+            pickle.load(f)
+        torch.load(models_dir / "ncf_model.pt", map_location=torch.device("cpu"), weights_only=True)
+
+    def bundle_load():
+        _, arrays = load_bundle(bundle_path)
+        state_dict_from_bundle(arrays)
+
+    results = {}
+    for name, fn in [("current", current_load), ("bundle", bundle_load)]:
+        timings = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - t0) * 1000)
+        results[name] = statistics.median(timings)
+        print(f"{name:>8} load: median {results[name]:.2f} ms over {repeats} runs")
+
+    print(f"Speedup: {results['current'] / max(results['bundle'], 1e-9):.1f}x")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile NCF serving artifacts into a memory-mappable bundle')
+    parser.add_argument('--models_dir', type=str, default=str(DEFAULT_BASE_PATH / "models"),
+                        help='Directory containing ncf_model.pt and ncf_model_mappings.pkl')
+    parser.add_argument('--data', type=str, default=str(DEFAULT_BASE_PATH / "data" / "recommendation_data.csv"),
+                        help='Interaction data used for the seen-items index and popularity list')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Bundle path (defaults to <models_dir>/ncf_serving.bundle)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Reload the written bundle and check its checksum')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='REPEATS',
+                        help='Time the current load path against the bundle')
+
+    args = parser.parse_args()
+    output = args.output or os.path.join(args.models_dir, "ncf_serving.bundle")
+
+    build_bundle(args.models_dir, args.data, output)
+
+    if args.verify:
+        load_bundle(output, verify=True)
+        print("Checksum verified.")
+
+    if args.benchmark:
+        benchmark(args.models_dir, args.data, output, repeats=args.benchmark)
+
+
+if __name__ == "__main__":
+    main()